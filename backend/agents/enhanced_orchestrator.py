@@ -1,177 +1,121 @@
-import google.generativeai as genai
-from typing import Dict, Any, List, Optional, Union
+from typing import TYPE_CHECKING, Dict, Any, AsyncIterator, List, Optional, Union
+import asyncio
 import os
 import re
-import json
+import sys
+import functools
 import time
-from datetime import datetime
-import hashlib
-import base64
 
+from agents.gemini_client import GEMINI_API_KEY, get_genai
+from agents.llm_cache import LLMCache
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
+GEMINI_EMBEDDING_MODEL = os.getenv("GEMINI_EMBEDDING_MODEL", "models/text-embedding-004")
+
+# Agent names are interned so name comparisons and dict lookups keyed on them
+# can short-circuit on identity
+_NLP = sys.intern("nlp_agent")
+_CODE = sys.intern("code_agent")
+_DATA = sys.intern("data_agent")
+
+# Attached files are trimmed to this many characters before routing and prompting
+_FILE_CONTEXT_LIMIT = 2000
+
+# How many agents may answer one request in parallel, and how close (in routing
+# score) a runner-up must be to the best agent to be consulted as well
+MAX_AGENTS_CONSULTED = int(os.getenv("MAX_AGENTS_CONSULTED", "1"))
+ENSEMBLE_SCORE_MARGIN = float(os.getenv("ENSEMBLE_SCORE_MARGIN", "0.2"))
+
+# Shared by all agents; entries are namespaced by agent name
+_RESPONSE_CACHE = LLMCache()
+
+# Gemini calls currently being made, keyed by the same prompt hash as the cache
+_IN_FLIGHT: Dict[str, asyncio.Future] = {}
+
+# Routing keywords are matched against whole words of the lowercased request,
+# so "data" no longer matches inside "metadata" and each check is a set lookup.
+_TOKEN_RE = re.compile(r"[a-z]+")
+
+_CODE_BLOCK_RE = re.compile(r'```(\w+)?\n(.*?)\n```', re.DOTALL)
+_QUOTED_RE = re.compile(r'"([^"]*)"')
+_TEXT_RE = re.compile(r'(?:text|sentiment)[:\s]+(.+)', re.IGNORECASE)
+
+_WORD_RE = re.compile(r"[a-z']+")
+_POSITIVE_WORDS = frozenset({"love", "great", "awesome", "amazing", "excellent", "fantastic", "wonderful", "good", "happy", "perfect", "best"})
+_NEGATIVE_WORDS = frozenset({"hate", "bad", "terrible", "awful", "horrible", "disgusting", "worst", "dislike", "angry", "disappointed", "poor"})
+
+# Markers that classify an attached file; one scan finds whichever comes first
+_FILE_CLASSIFIER = re.compile(r'(?P<code>def |function|class |import|from )|(?P<data>,|csv|json|data)', re.IGNORECASE)
+_DATA_INTENT = frozenset({"analyze", "data", "statistics", "chart", "visualization"})
+
+_CAN_HANDLE = {
+    _NLP: frozenset({"analyze", "sentiment", "summarize", "text", "language", "meaning", "translate", "content", "document"}),
+    _CODE: frozenset({"code", "python", "javascript", "function", "programming", "debug", "write", "algorithm", "script"}),
+    _DATA: frozenset({"data", "analysis", "statistics", "chart", "visualization", "csv", "dataset", "graph"}),
+}
+
+_CAN_HANDLE_FILE = {
+    _NLP: frozenset({"text", "document", "analyze", "sentiment", "summarize", "content"}),
+    _CODE: frozenset({"code", "function", "class", "algorithm", "programming", "script"}),
+    _DATA: frozenset({"csv", "json", "data", "dataset", "analysis", "statistics", "chart"}),
+}
+
+# Routing weight per keyword: 0.3 strong signal, 0.2 medium, 0.1 weak
+_SCORE_TABLE = {
+    "nlp": {
+        "sentiment": 0.3, "analyze": 0.3, "summarize": 0.3, "text": 0.3, "content": 0.3, "document": 0.3,
+        "language": 0.2, "meaning": 0.2, "review": 0.2, "translate": 0.2, "writing": 0.2,
+        "read": 0.1, "understand": 0.1, "explain": 0.1,
+    },
+    "code": {
+        "code": 0.3, "function": 0.3, "programming": 0.3, "debug": 0.3, "algorithm": 0.3,
+        "python": 0.2, "javascript": 0.2, "write": 0.2, "create": 0.2, "develop": 0.2,
+        "script": 0.1, "program": 0.1, "software": 0.1,
+    },
+    "data": {
+        "data": 0.3, "analysis": 0.3, "statistics": 0.3, "visualization": 0.3, "chart": 0.3,
+        "dataset": 0.2, "graph": 0.2, "plot": 0.2, "csv": 0.2, "numbers": 0.2,
+        "information": 0.1, "calculate": 0.1, "math": 0.1,
+    },
+}
+
+
+def _tokenize(text: str) -> set:
+    """Lowercase and split text into a set of alphabetic words"""
+    return set(_TOKEN_RE.findall(text.lower()))
+
+
+@functools.lru_cache(maxsize=1)
+def _get_model() -> Optional["genai.GenerativeModel"]:
+    """Single GenerativeModel shared by every agent (and its HTTP connections)"""
+    if not GEMINI_API_KEY:
+        print("Warning: No Gemini API key found, agents will use fallback responses")
+        return None
+    try:
+        return get_genai().GenerativeModel('gemini-2.0-flash-lite')
+    except Exception as e:
+        print(f"Gemini initialization error: {e}")
+        return None
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
 
-class EnhancedGeminiAgent:
-    def __init__(self, name: str, capabilities: List[str], system_prompt: str, orchestrator: Optional['EnhancedGeminiOrchestrator'] = None):
-        self.name = name
-        self.capabilities = capabilities
-        self.system_prompt = system_prompt
-        self.orchestrator = orchestrator
-        self.processing_status = "idle"
-        
-        
-        try:
-            if GEMINI_API_KEY:
-                self.model = genai.GenerativeModel('gemini-2.0-flash-lite')
-            else:
-                self.model = None
-                print(f"Warning: No Gemini API key found for {name}")
-        except Exception as e:
-            print(f"Gemini initialization error for {name}: {e}")
-            self.model = None
-    
-    def can_handle(self, task: str, file_content: str = None) -> bool:
-        
-        task_lower = task.lower()
-        
-        if file_content:
-            if self.name == "data_agent":
-                data_indicators = ["csv", "json", "data", "dataset", "analysis", "statistics", "chart"]
-                return any(indicator in task_lower for indicator in data_indicators)
-            elif self.name == "code_agent":
-                code_indicators = ["code", "function", "class", "algorithm", "programming", "script"]
-                return any(indicator in task_lower for indicator in code_indicators)
-            elif self.name == "nlp_agent":
-                text_indicators = ["text", "document", "analyze", "sentiment", "summarize", "content"]
-                return any(indicator in task_lower for indicator in text_indicators)
-        
-        if self.name == "nlp_agent":
-            keywords = ["analyze", "sentiment", "summarize", "text", "language", "meaning", "translate", "content", "document"]
-            return any(keyword in task_lower for keyword in keywords)
-        elif self.name == "code_agent":
-            keywords = ["code", "python", "javascript", "function", "programming", "debug", "write", "algorithm", "script"]
-            return any(keyword in task_lower for keyword in keywords)
-        elif self.name == "data_agent":
-            keywords = ["data", "analysis", "statistics", "chart", "visualization", "csv", "dataset", "graph"]
-            return any(keyword in task_lower for keyword in keywords)
-        
-        return False
-    
-    def set_status(self, status: str):
-        self.processing_status = status
-        if self.orchestrator:
-            self.orchestrator.update_agent_status(self.name, status)
-    
-    def process(self, user_input: str, context: Dict[str, Any] = None, file_content: str = None) -> Dict[str, Any]:
-        self.set_status("processing")
-        
-        try:
-            full_context = {
-                "user_input": user_input,
-                "agent_name": self.name,
-                "timestamp": datetime.now().isoformat(),
-                "has_file": file_content is not None
-            }
-            
-            if file_content:
-                full_context["file_content"] = file_content[:2000]  # Limit for context
-            
-            if not self.model or not GEMINI_API_KEY:
-                response = self._enhanced_fallback_response(user_input, file_content)
-            else:
-                response = self._generate_gemini_response(user_input, file_content)
-            
-            self.set_status("idle")
-            
-            return {
-                "success": True,
-                "agent": self.name,
-                "response": response,
-                "metadata": {
-                    "model": "gemini-2.0-flash-lite" if self.model else "fallback",
-                    "processing_time": time.time(),
-                    "context": full_context
-                }
-            }
-            
-        except Exception as e:
-            self.set_status("error")
-            return {
-                "success": False,
-                "agent": self.name,
-                "response": f"I encountered an error while processing your request: {str(e)}",
-                "metadata": {"error": str(e), "status": "error"}
-            }
-    
-    def _generate_gemini_response(self, user_input: str, file_content: str = None) -> str:
-        """Generate response using Gemini with enhanced prompting"""
-        
-        enhanced_prompt = f"""
-{self.system_prompt}
+def _embed(text: str) -> Optional[List[float]]:
+    """Embed text for semantic cache lookups; None if embedding is unavailable"""
+    try:
+        result = get_genai().embed_content(model=GEMINI_EMBEDDING_MODEL, content=text, task_type="semantic_similarity")
+        return result["embedding"]
+    except Exception as e:
+        print(f"Embedding error: {e}")
+        return None
 
-IMPORTANT FORMATTING GUIDELINES:
-- For code: Always use proper markdown formatting with language specification
-- Provide clear explanations after code blocks
-- Use professional, natural language
-- Structure responses with clear sections when appropriate
 
-User Request: {user_input}
-"""
-        
-        if file_content:
-            enhanced_prompt += f"\nFile Content (first 2000 chars):\n{file_content[:2000]}"
-        
-        enhanced_prompt += "\n\nProvide a comprehensive, well-formatted response:"
-        
-        try:
-            response = self.model.generate_content(enhanced_prompt)
-            return self._format_response(response.text)
-        except Exception as e:
-            return self._enhanced_fallback_response(user_input, file_content)
-    
-    def _format_response(self, raw_response: str) -> str:
-        """Format response for better presentation"""
-        formatted_response = raw_response
-        
-        code_block_pattern = r'```(\w+)?\n(.*?)\n```'
-        
-        def add_copy_indicator(match):
-            language = match.group(1) or 'text'
-            code = match.group(2)
-            return f'```{language}\n{code}\n```'
-        
-        formatted_response = re.sub(code_block_pattern, add_copy_indicator, formatted_response, flags=re.DOTALL)
-        
-        return formatted_response
-    
-    def _enhanced_fallback_response(self, user_input: str, file_content: str = None) -> str:
-        """Enhanced fallback responses with file support"""
-        
-        if file_content:
-            return self._file_based_fallback(user_input, file_content)
-        
-        if self.name == "nlp_agent":
-            return self._nlp_enhanced_fallback(user_input)
-        elif self.name == "code_agent":
-            return self._code_enhanced_fallback(user_input)
-        elif self.name == "data_agent":
-            return self._data_enhanced_fallback(user_input)
-        
-        return "I'm ready to help! Please provide more specific details about what you need."
-    
-    def _file_based_fallback(self, user_input: str, file_content: str) -> str:
-        """Handle file-based requests with fallback responses"""
-        
-        content_preview = file_content[:500] if file_content else ""
-        
-        if self.name == "nlp_agent":
-            return f"""## Document Analysis
+# Static fallback responses used when Gemini is unavailable
+_FALLBACK_FILE_NLP = """## Document Analysis
 
 **File Content Preview:**
 ```
-{content_preview}...
+{preview}...
 ```
 
 **Analysis Capabilities:**
@@ -185,13 +129,12 @@ Based on the content preview, this appears to be a text document with substantia
 
 *Note: Add a Gemini API key for detailed AI-powered analysis.*
 """
-        
-        elif self.name == "code_agent":
-            return f"""## Code Analysis
+
+_FALLBACK_FILE_CODE = """## Code Analysis
 
 **File Content Preview:**
 ```
-{content_preview}...
+{preview}...
 ```
 
 **Code Analysis Capabilities:**
@@ -205,13 +148,12 @@ This appears to be a code file. I can help with analysis, debugging, optimizatio
 
 *Note: Add a Gemini API key for advanced code analysis and generation.*
 """
-        
-        else:  # data_agent
-            return f"""## Data Analysis
+
+_FALLBACK_FILE_DATA = """## Data Analysis
 
 **File Content Preview:**
 ```
-{content_preview}...
+{preview}...
 ```
 
 **Data Analysis Capabilities:**
@@ -225,14 +167,8 @@ This appears to be a data file. I can help with analysis, visualization, and ins
 
 *Note: Add a Gemini API key for detailed data analysis and code generation.*
 """
-    
-    def _nlp_enhanced_fallback(self, user_input: str) -> str:
-        user_lower = user_input.lower()
-        
-        if "sentiment" in user_lower:
-            return self._analyze_sentiment_with_formatting(user_input)
-        
-        return """## Natural Language Processing Assistant
+
+_FALLBACK_NLP = """## Natural Language Processing Assistant
 
 I'm your **NLP specialist** ready to help with:
 
@@ -251,14 +187,8 @@ I'm your **NLP specialist** ready to help with:
 
 *For advanced AI-powered analysis, please configure a Gemini API key.*
 """
-    
-    def _code_enhanced_fallback(self, user_input: str) -> str:
-        user_lower = user_input.lower()
-        
-        if any(lang in user_lower for lang in ["python", "javascript", "java", "cpp", "c++"]):
-            return self._generate_code_example(user_input)
-        
-        return """## Programming Assistant
+
+_FALLBACK_CODE = """## Programming Assistant
 
 I'm your **Code specialist** ready to help with:
 
@@ -284,10 +214,8 @@ I'm your **Code specialist** ready to help with:
 
 *For advanced code generation and analysis, please configure a Gemini API key.*
 """
-    
-    def _data_enhanced_fallback(self, user_input: str) -> str:
-        """Enhanced data analysis fallback"""
-        return """## Data Science Assistant
+
+_FALLBACK_DATA = """## Data Science Assistant
 
 I'm your **Data specialist** ready to help with:
 
@@ -312,62 +240,8 @@ I'm your **Data specialist** ready to help with:
 
 *For detailed analysis and code generation, please configure a Gemini API key.*
 """
-    
-    def _analyze_sentiment_with_formatting(self, user_input: str) -> str:
-        
-        # Extract text to analyze
-        quoted_text = re.findall(r'"([^"]*)"', user_input)
-        if quoted_text:
-            text_to_analyze = quoted_text[0]
-        else:
-            text_match = re.search(r'(?:text|sentiment)[:\s]+(.+)', user_input, re.IGNORECASE)
-            if text_match:
-                text_to_analyze = text_match.group(1).strip()
-            else:
-                text_to_analyze = user_input
-        
-        positive_words = ["love", "great", "awesome", "amazing", "excellent", "fantastic", "wonderful", "good", "happy", "perfect", "best"]
-        negative_words = ["hate", "bad", "terrible", "awful", "horrible", "disgusting", "worst", "dislike", "angry", "disappointed", "poor"]
-        
-        text_lower = text_to_analyze.lower()
-        positive_count = sum(1 for word in positive_words if word in text_lower)
-        negative_count = sum(1 for word in negative_words if word in text_lower)
-        
-        if negative_count > positive_count:
-            sentiment = "**Negative** 😔"
-            confidence = "High" if negative_count > 1 else "Moderate"
-            indicators = [word for word in negative_words if word in text_lower]
-        elif positive_count > negative_count:
-            sentiment = "**Positive** 😊"
-            confidence = "High" if positive_count > 1 else "Moderate"
-            indicators = [word for word in positive_words if word in text_lower]
-        else:
-            sentiment = "**Neutral** 😐"
-            confidence = "Moderate"
-            indicators = []
 
-        return f"""## Sentiment Analysis Results
-
-### Text Analyzed
-> "{text_to_analyze}"
-
-### Analysis Summary
-- **Overall Sentiment**: {sentiment}
-- **Confidence Level**: {confidence}
-- **Key Indicators**: {', '.join(indicators) if indicators else 'Neutral language patterns'}
-
-### Detailed Insights
-{self._get_sentiment_explanation(sentiment, indicators, text_to_analyze)}
-
----
-*For more advanced sentiment analysis including context, emotion detection, and intensity scoring, please configure a Gemini API key.*
-"""
-    
-    def _generate_code_example(self, user_input: str) -> str:
-        """Generate code examples with proper formatting"""
-        
-        if "python" in user_input.lower() and "function" in user_input.lower():
-            return """## Python Function Example
+_FALLBACK_PYTHON_FUNCTION = """## Python Function Example
 
 ```python
 def add_two_numbers(a, b):
@@ -414,6 +288,306 @@ if __name__ == "__main__":
 
 *For more complex code generation and advanced algorithms, please configure a Gemini API key.*
 """
+
+_FILE_FALLBACKS = {
+    _NLP: _FALLBACK_FILE_NLP,
+    _CODE: _FALLBACK_FILE_CODE,
+    _DATA: _FALLBACK_FILE_DATA,
+}
+
+
+class EnhancedGeminiAgent:
+    def __init__(self, name: str, capabilities: List[str], system_prompt: str, orchestrator: Optional['EnhancedGeminiOrchestrator'] = None):
+        self.name = sys.intern(name)
+        self.capabilities = capabilities
+        self.system_prompt = system_prompt
+        self.orchestrator = orchestrator
+        self.processing_status = "idle"
+        self.model = _get_model()
+        
+        # Per-agent behaviour is resolved once here rather than by comparing
+        # self.name on every request
+        self._fallback = {
+            _NLP: self._nlp_enhanced_fallback,
+            _CODE: self._code_enhanced_fallback,
+            _DATA: self._data_enhanced_fallback,
+        }.get(name, self._generic_fallback)
+        self._file_fallback_template = _FILE_FALLBACKS.get(name, _FALLBACK_FILE_DATA)
+        self._can_handle_keywords = _CAN_HANDLE.get(name, frozenset())
+        self._can_handle_file_keywords = _CAN_HANDLE_FILE.get(name, frozenset())
+    
+    def can_handle(self, task: str, file_content: str = None) -> bool:
+        keywords = self._can_handle_file_keywords if file_content else self._can_handle_keywords
+        return not _tokenize(task).isdisjoint(keywords)
+    
+    def set_status(self, status: str):
+        self.processing_status = status
+        if self.orchestrator:
+            self.orchestrator.update_agent_status(self.name, status)
+    
+    async def process(self, user_input: str, context: Dict[str, Any] = None, file_content: str = None) -> Dict[str, Any]:
+        self.set_status("processing")
+        
+        try:
+            if not self.model or not GEMINI_API_KEY:
+                response = self._enhanced_fallback_response(user_input, file_content)
+            else:
+                response = await self._generate_gemini_response(user_input, file_content)
+            
+            self.set_status("idle")
+            
+            return {
+                "success": True,
+                "agent": self.name,
+                "response": response,
+                "metadata": {
+                    "model": "gemini-2.0-flash-lite" if self.model else "fallback",
+                    "has_file_context": file_content is not None
+                }
+            }
+            
+        except Exception as e:
+            self.set_status("error")
+            return {
+                "success": False,
+                "agent": self.name,
+                "response": f"I encountered an error while processing your request: {str(e)}",
+                "metadata": {"error": str(e), "status": "error"}
+            }
+    
+    async def process_stream(self, user_input: str, file_content: str = None) -> AsyncIterator[str]:
+        """Yield the response in formatted pieces as soon as Gemini produces them"""
+        self.set_status("processing")
+        
+        try:
+            if not self.model or not GEMINI_API_KEY:
+                yield self._enhanced_fallback_response(user_input, file_content)
+            else:
+                async for piece in self._stream_gemini_response(user_input, file_content):
+                    yield piece
+            
+            self.set_status("idle")
+            
+        except Exception as e:
+            self.set_status("error")
+            yield f"I encountered an error while processing your request: {str(e)}"
+    
+    def _build_prompt(self, user_input: str, file_content: str = None) -> str:
+        enhanced_prompt = f"""
+{self.system_prompt}
+
+IMPORTANT FORMATTING GUIDELINES:
+- For code: Always use proper markdown formatting with language specification
+- Provide clear explanations after code blocks
+- Use professional, natural language
+- Structure responses with clear sections when appropriate
+
+User Request: {user_input}
+"""
+        
+        if file_content:
+            enhanced_prompt += f"\nFile Content (first {_FILE_CONTEXT_LIMIT} chars):\n{file_content}"
+        
+        enhanced_prompt += "\n\nProvide a comprehensive, well-formatted response:"
+        return enhanced_prompt
+    
+    async def _semantic_lookup(self, user_input: str, file_content: str = None):
+        """Look up a near-duplicate request; returns (cached response or None, embedding for storing)"""
+        # Only for plain questions; the same question about two different
+        # files must not share an answer
+        if file_content:
+            return None, None
+        
+        embedding = await asyncio.to_thread(_embed, user_input)
+        if embedding is None:
+            return None, None
+        
+        return _RESPONSE_CACHE.semantic_lookup(embedding, namespace=self.name), embedding
+    
+    async def _generate_gemini_response(self, user_input: str, file_content: str = None) -> str:
+        """Generate response using Gemini with enhanced prompting"""
+        enhanced_prompt = self._build_prompt(user_input, file_content)
+        
+        cache_key = LLMCache.make_key(self.name, enhanced_prompt)
+        cached = _RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # An identical prompt already being generated: wait for that call
+        # instead of issuing another one
+        in_flight = _IN_FLIGHT.get(cache_key)
+        if in_flight is not None:
+            await asyncio.wait((in_flight,))
+            if not in_flight.cancelled():
+                return in_flight.result()
+        
+        future = asyncio.get_running_loop().create_future()
+        _IN_FLIGHT[cache_key] = future
+        try:
+            response = await self._generate_uncached(enhanced_prompt, cache_key, user_input, file_content)
+            future.set_result(response)
+            return response
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            if _IN_FLIGHT.get(cache_key) is future:
+                del _IN_FLIGHT[cache_key]
+    
+    async def _generate_uncached(self, enhanced_prompt: str, cache_key: str, user_input: str, file_content: str = None) -> str:
+        cached, embedding = await self._semantic_lookup(user_input, file_content)
+        if cached is not None:
+            return cached
+        
+        try:
+            response = await self.model.generate_content_async(enhanced_prompt)
+            formatted = self._format_response(response.text)
+        except Exception as e:
+            return self._enhanced_fallback_response(user_input, file_content)
+        
+        _RESPONSE_CACHE.set(cache_key, formatted, embedding, namespace=self.name)
+        return formatted
+    
+    async def _stream_gemini_response(self, user_input: str, file_content: str = None) -> AsyncIterator[str]:
+        """Streaming counterpart of _generate_gemini_response"""
+        enhanced_prompt = self._build_prompt(user_input, file_content)
+        
+        cache_key = LLMCache.make_key(self.name, enhanced_prompt)
+        cached = _RESPONSE_CACHE.get(cache_key)
+        if cached is None:
+            cached, embedding = await self._semantic_lookup(user_input, file_content)
+        if cached is not None:
+            yield cached
+            return
+        
+        pieces = []
+        pending = ""
+        try:
+            stream = await self.model.generate_content_async(enhanced_prompt, stream=True)
+            async for chunk in stream:
+                pending += chunk.text
+                # Hold text back while a code fence is open (or may be half
+                # received) so each fence reaches _format_response whole
+                if pending.count('```') % 2 == 0 and not pending.endswith('`'):
+                    piece = self._format_response(pending)
+                    pieces.append(piece)
+                    pending = ""
+                    yield piece
+        except Exception as e:
+            print(f"Gemini streaming error: {e}")
+            if pieces:
+                raise
+            yield self._enhanced_fallback_response(user_input, file_content)
+            return
+        
+        if pending:
+            piece = self._format_response(pending)
+            pieces.append(piece)
+            yield piece
+        
+        _RESPONSE_CACHE.set(cache_key, "".join(pieces), embedding, namespace=self.name)
+    
+    def _format_response(self, raw_response: str) -> str:
+        """Format response for better presentation"""
+        if '```' not in raw_response:
+            return raw_response
+        
+        def add_copy_indicator(match):
+            language = match.group(1) or 'text'
+            code = match.group(2)
+            return f'```{language}\n{code}\n```'
+        
+        return _CODE_BLOCK_RE.sub(add_copy_indicator, raw_response)
+    
+    def _enhanced_fallback_response(self, user_input: str, file_content: str = None) -> str:
+        """Enhanced fallback responses with file support"""
+        if file_content:
+            return self._file_based_fallback(user_input, file_content)
+        return self._fallback(user_input)
+    
+    def _generic_fallback(self, user_input: str) -> str:
+        return "I'm ready to help! Please provide more specific details about what you need."
+    
+    def _file_based_fallback(self, user_input: str, file_content: str) -> str:
+        """Handle file-based requests with fallback responses"""
+        content_preview = file_content[:500] if file_content else ""
+        return self._file_fallback_template.format(preview=content_preview)
+    
+    def _nlp_enhanced_fallback(self, user_input: str) -> str:
+        user_lower = user_input.lower()
+        
+        if "sentiment" in user_lower:
+            return self._analyze_sentiment_with_formatting(user_input)
+        
+        return _FALLBACK_NLP
+    
+    def _code_enhanced_fallback(self, user_input: str) -> str:
+        user_lower = user_input.lower()
+        
+        if any(lang in user_lower for lang in ["python", "javascript", "java", "cpp", "c++"]):
+            return self._generate_code_example(user_input)
+        
+        return _FALLBACK_CODE
+    
+    def _data_enhanced_fallback(self, user_input: str) -> str:
+        """Enhanced data analysis fallback"""
+        return _FALLBACK_DATA
+    
+    def _analyze_sentiment_with_formatting(self, user_input: str) -> str:
+        
+        # Extract text to analyze
+        quoted_text = _QUOTED_RE.findall(user_input)
+        if quoted_text:
+            text_to_analyze = quoted_text[0]
+        else:
+            text_match = _TEXT_RE.search(user_input)
+            if text_match:
+                text_to_analyze = text_match.group(1).strip()
+            else:
+                text_to_analyze = user_input
+        
+        # One pass over the words; each distinct sentiment word counts once
+        words = _WORD_RE.findall(text_to_analyze.lower())
+        positive_hits = list(dict.fromkeys(word for word in words if word in _POSITIVE_WORDS))
+        negative_hits = list(dict.fromkeys(word for word in words if word in _NEGATIVE_WORDS))
+        positive_count = len(positive_hits)
+        negative_count = len(negative_hits)
+        
+        if negative_count > positive_count:
+            sentiment = "**Negative** 😔"
+            confidence = "High" if negative_count > 1 else "Moderate"
+            indicators = negative_hits
+        elif positive_count > negative_count:
+            sentiment = "**Positive** 😊"
+            confidence = "High" if positive_count > 1 else "Moderate"
+            indicators = positive_hits
+        else:
+            sentiment = "**Neutral** 😐"
+            confidence = "Moderate"
+            indicators = []
+
+        return f"""## Sentiment Analysis Results
+
+### Text Analyzed
+> "{text_to_analyze}"
+
+### Analysis Summary
+- **Overall Sentiment**: {sentiment}
+- **Confidence Level**: {confidence}
+- **Key Indicators**: {', '.join(indicators) if indicators else 'Neutral language patterns'}
+
+### Detailed Insights
+{self._get_sentiment_explanation(sentiment, indicators, text_to_analyze)}
+
+---
+*For more advanced sentiment analysis including context, emotion detection, and intensity scoring, please configure a Gemini API key.*
+"""
+    
+    def _generate_code_example(self, user_input: str) -> str:
+        """Generate code examples with proper formatting"""
+        
+        if "python" in user_input.lower() and "function" in user_input.lower():
+            return _FALLBACK_PYTHON_FUNCTION
         
         return "I can help you generate code! Please specify the programming language and what you'd like to create."
     
@@ -433,7 +607,7 @@ class EnhancedGeminiOrchestrator:
         # Initialize enhanced agents
         self.agents = {
             "nlp": EnhancedGeminiAgent(
-                name="nlp_agent",
+                name=_NLP,
                 capabilities=["text_analysis", "sentiment_analysis", "summarization", "content_review"],
                 system_prompt="""You are an expert Natural Language Processing specialist. Your role is to analyze text, provide sentiment analysis, create summaries, and offer linguistic insights. 
 
@@ -448,7 +622,7 @@ Focus on accuracy, clarity, and practical value in your analysis.""",
                 orchestrator=self
             ),
             "code": EnhancedGeminiAgent(
-                name="code_agent",
+                name=_CODE,
                 capabilities=["code_generation", "debugging", "code_review", "algorithm_design"],
                 system_prompt="""You are an expert Software Developer and Programming Assistant. Your role is to write clean, efficient code, debug issues, and provide technical guidance.
 
@@ -464,7 +638,7 @@ Focus on writing production-ready, well-documented code with proper error handli
                 orchestrator=self
             ),
             "data": EnhancedGeminiAgent(
-                name="data_agent",
+                name=_DATA,
                 capabilities=["data_analysis", "statistics", "visualization", "machine_learning"],
                 system_prompt="""You are an expert Data Scientist and Analytics Specialist. Your role is to analyze data, provide statistical insights, and recommend visualization strategies.
 
@@ -480,6 +654,12 @@ Focus on practical, actionable data science solutions with robust methodologies
                 orchestrator=self
             )
         }
+        
+        # Name and capabilities never change, so only status is filled in per call
+        self._agent_info = [
+            (agent, {"name": agent.name, "capabilities": agent.capabilities})
+            for agent in self.agents.values()
+        ]
     
     def update_agent_status(self, agent_name: str, status: str):
         """Update agent status for UI display"""
@@ -491,49 +671,70 @@ Focus on practical, actionable data science solutions with robust methodologies
     def get_agent_status(self) -> Dict[str, Any]:
         """Get comprehensive agent status"""
         api_status = "configured" if GEMINI_API_KEY else "missing"
+        now = time.time()
         
         return {
             "orchestrator_status": "active",
             "api_status": api_status,
             "available_agents": [
                 {
-                    "name": agent.name,
-                    "capabilities": agent.capabilities,
+                    **info,
                     "status": agent.processing_status,
-                    "last_updated": self.agent_status.get(agent.name, {}).get("timestamp", time.time())
+                    "last_updated": self.agent_status.get(agent.name, {}).get("timestamp", now)
                 }
-                for agent in self.agents.values()
+                for agent, info in self._agent_info
             ],
             "total_agents": len(self.agents),
             "real_time_status": self.agent_status
         }
     
-    def process_request(self, user_input: str, session_id: str = None, file_content: str = None, file_name: str = None) -> Dict[str, Any]:
+    async def process_request(self, user_input: str, session_id: str = None, file_content: str = None, file_name: str = None) -> Dict[str, Any]:
         """Enhanced request processing with file support"""
+        started_ns = time.monotonic_ns()
+        
+        # Trim once here; routing, prompting and fallbacks all share this copy
+        file_content = file_content[:_FILE_CONTEXT_LIMIT] if file_content else None
         
         try:
-            selected_agent = self._route_request(user_input, file_content)
+            selected_agents = self._select_agents(user_input, file_content)
 
-            if selected_agent in self.agents:
-                self.agents[selected_agent].set_status("processing")
+            if selected_agents:
+                for agent_name in selected_agents:
+                    self.agents[agent_name].set_status("processing")
                 
-                response = self.agents[selected_agent].process(
-                    user_input, 
-                    context={"session_id": session_id, "file_name": file_name},
-                    file_content=file_content
+                context = {"session_id": session_id, "file_name": file_name}
+                results = await asyncio.gather(
+                    *(self.agents[agent_name].process(user_input, context=context, file_content=file_content)
+                      for agent_name in selected_agents),
+                    return_exceptions=True
                 )
                 
+                responses = []
+                for agent_name, result in zip(selected_agents, results):
+                    if isinstance(result, Exception):
+                        self.agents[agent_name].set_status("error")
+                        result = {
+                            "success": False,
+                            "agent": self.agents[agent_name].name,
+                            "response": f"I encountered an error while processing your request: {str(result)}",
+                            "metadata": {"error": str(result), "status": "error"}
+                        }
+                    responses.append(result)
+                
+                # Agents are ordered best-first; combine every successful answer
+                answered = [r for r in responses if r.get("success", True)] or responses[:1]
+                final_response = "\n\n---\n\n".join(r.get("response", "No response generated") for r in answered)
+                
                 return {
-                    "success": response.get("success", True),
-                    "final_response": response.get("response", "No response generated"),
-                    "agent_responses": [response],
+                    "success": answered[0].get("success", True),
+                    "final_response": final_response,
+                    "agent_responses": responses,
                     "metadata": {
-                        "selected_agent": selected_agent,
-                        "agents_consulted": [selected_agent],
-                        "routing_decision": {"selected": selected_agent, "confidence": 0.9},
+                        "selected_agent": selected_agents[0],
+                        "agents_consulted": selected_agents,
+                        "routing_decision": {"selected": selected_agents[0], "confidence": 0.9},
                         "file_processed": file_content is not None,
-                        "processing_time": time.time(),
-                        "agent_status": self.get_agent_status()
+                        "processing_time_ns": time.monotonic_ns() - started_ns
                     }
                 }
             else:
@@ -553,68 +754,99 @@ Focus on practical, actionable data science solutions with robust methodologies
                 "metadata": {"error": str(e), "timestamp": time.time()}
             }
     
+    async def process_request_stream(self, user_input: str, session_id: str = None, file_content: str = None, file_name: str = None) -> AsyncIterator[Dict[str, Any]]:
+        """Streaming variant of process_request: yields response deltas, then a
+        final "done" event shaped like the process_request result"""
+        started_ns = time.monotonic_ns()
+        file_content = file_content[:_FILE_CONTEXT_LIMIT] if file_content else None
+        
+        selected_agent = self._route_request(user_input, file_content)
+        agent = self.agents[selected_agent]
+        
+        pieces = []
+        async for delta in agent.process_stream(user_input, file_content=file_content):
+            pieces.append(delta)
+            yield {"type": "delta", "agent": selected_agent, "delta": delta}
+        
+        success = agent.processing_status != "error"
+        final_response = "".join(pieces)
+        yield {
+            "type": "done",
+            "success": success,
+            "final_response": final_response,
+            "agent_responses": [{
+                "success": success,
+                "agent": agent.name,
+                "response": final_response,
+                "metadata": {"model": "gemini-2.0-flash-lite" if agent.model else "fallback"}
+            }],
+            "metadata": {
+                "selected_agent": selected_agent,
+                "agents_consulted": [selected_agent],
+                "routing_decision": {"selected": selected_agent, "confidence": 0.9},
+                "file_processed": file_content is not None,
+                "processing_time_ns": time.monotonic_ns() - started_ns,
+                "streamed": True
+            }
+        }
+    
+    def _select_agents(self, user_input: str, file_content: str = None) -> List[str]:
+        """Best agent first, plus any runner-ups close enough to consult in parallel"""
+        if file_content or MAX_AGENTS_CONSULTED <= 1:
+            return [self._route_request(user_input, file_content)]
+
+        scores = self._score_agents(user_input)
+        if not scores:
+            return ["nlp"]
+
+        ranked = sorted(scores, key=scores.__getitem__, reverse=True)
+        best_score = scores[ranked[0]]
+        return [ranked[0]] + [
+            agent_name for agent_name in ranked[1:MAX_AGENTS_CONSULTED]
+            if scores[agent_name] > 0 and best_score - scores[agent_name] <= ENSEMBLE_SCORE_MARGIN
+        ]
+    
     def _route_request(self, user_input: str, file_content: str = None) -> str:
         """Enhanced routing with file content analysis"""
-        user_lower = user_input.lower()
-
         if file_content:
-            content_lower = file_content.lower()
+            return self._classify_file(file_content, wants_data=not _DATA_INTENT.isdisjoint(_tokenize(user_input)))
 
-            if any(pattern in content_lower for pattern in [",", "csv", "json", "data", "dataset"]):
-                if any(keyword in user_lower for keyword in ["analyze", "data", "statistics", "chart", "visualization"]):
+        # No eligible agent means the request falls through to the NLP default
+        scores = self._score_agents(user_input)
+        if not scores:
+            return "nlp"
+        return max(scores, key=scores.__getitem__)
+    
+    def _score_agents(self, user_input: str) -> Dict[str, float]:
+        """Score the agents whose can_handle keywords match, from a single tokenization of the request"""
+        tokens = _tokenize(user_input)
+        return {
+            agent_name: self._calculate_enhanced_score(user_input, agent_name, tokens)
+            for agent_name, agent in self.agents.items()
+            if not tokens.isdisjoint(agent._can_handle_keywords)
+        }
+    
+    def _classify_file(self, file_content: str, wants_data: bool) -> str:
+        """Pick an agent from file markers, stopping at the first decisive match"""
+        has_code = False
+        for match in _FILE_CLASSIFIER.finditer(file_content):
+            if match.lastgroup == "data":
+                if wants_data:
                     return "data"
-
-            if any(pattern in content_lower for pattern in ["def ", "function", "class ", "import", "from "]):
+            elif not wants_data:
                 return "code"
+            else:
+                has_code = True
 
-            return "nlp"
-
-        scores = {}
-        for agent_name, agent in self.agents.items():
-            if agent.can_handle(user_input, file_content):
-                scores[agent_name] = self._calculate_enhanced_score(user_input, agent_name)
-
-        if scores:
-            return max(scores.items(), key=lambda x: x[1])[0]
-        else:
-            return "nlp"  
+        return "code" if has_code else "nlp"
     
-    def _calculate_enhanced_score(self, user_input: str, agent_name: str) -> float:
+    def _calculate_enhanced_score(self, user_input: str, agent_name: str, tokens: set = None) -> float:
         """Enhanced scoring algorithm for better routing"""
-        user_lower = user_input.lower()
-        base_score = 0.0
-        
-        if agent_name == "nlp":
-            keywords = {
-                "high": ["sentiment", "analyze", "summarize", "text", "content", "document"],
-                "medium": ["language", "meaning", "review", "translate", "writing"],
-                "low": ["read", "understand", "explain"]
-            }
-        elif agent_name == "code":
-            keywords = {
-                "high": ["code", "function", "programming", "debug", "algorithm"],
-                "medium": ["python", "javascript", "write", "create", "develop"],
-                "low": ["script", "program", "software"]
-            }
-        elif agent_name == "data":
-            keywords = {
-                "high": ["data", "analysis", "statistics", "visualization", "chart"],
-                "medium": ["dataset", "graph", "plot", "csv", "numbers"],
-                "low": ["information", "calculate", "math"]
-            }
-        else:
+        weights = _SCORE_TABLE.get(agent_name)
+        if weights is None:
             return 0.0
         
-        for word in keywords["high"]:
-            if word in user_lower:
-                base_score += 0.3
-        
-        for word in keywords["medium"]:
-            if word in user_lower:
-                base_score += 0.2
-        
-        for word in keywords["low"]:
-            if word in user_lower:
-                base_score += 0.1
+        if tokens is None:
+            tokens = _tokenize(user_input)
         
-        return base_score
\ No newline at end of file
+        return sum(weights.get(token, 0.0) for token in tokens)
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+# Left to the SDK unless set: it picks the right transport for the sync and the
+# async (generate_content_async) clients, and forcing one applies to both
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT", "")
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT", "")
+
+_genai = None
+_lock = threading.Lock()
+
+
+def get_genai():
+    """Import and configure google.generativeai once per process, on first use"""
+    # The import pulls in gRPC and protobuf, so it is deferred until a model is
+    # actually needed (never, in fallback-only deployments). Both orchestrators
+    # come through here, so there is exactly one genai.configure call and the
+    # SDK's clients and connections are shared
+    global _genai
+    if _genai is None:
+        with _lock:
+            if _genai is None:
+                import google.generativeai as genai
+
+                options = {"api_key": GEMINI_API_KEY}
+                if GEMINI_TRANSPORT:
+                    options["transport"] = GEMINI_TRANSPORT
+                if GEMINI_API_ENDPOINT:
+                    options["client_options"] = {"api_endpoint": GEMINI_API_ENDPOINT}
+                genai.configure(**options)
+                _genai = genai
+    return _genai
+
+
+class CircuitBreaker:
+    """Stops calling Gemini during an outage instead of paying a timeout per request.
+
+    After fail_max consecutive failures the breaker opens and allow() returns
+    False for reset_timeout seconds; after that one trial call is let through,
+    and its outcome closes or re-opens the breaker. A trial that ends without
+    an outcome (cancelled, or its stream closed early) must release() it so
+    the next caller can take it.
+    """
+
+    def __init__(self, fail_max: int = 5, reset_timeout: float = 30):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_owner = None
+        self._lock = threading.Lock()
+
+    def allow(self, owner=None) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Half-open: let this call through as the trial, and hold
+                # everything else back until it reports in
+                self._opened_at = time.monotonic()
+                self._trial_owner = owner
+                return True
+            return False
+
+    def holds_trial(self, owner) -> bool:
+        with self._lock:
+            return owner is not None and self._trial_owner is owner
+
+    def release(self, owner):
+        """Give up the trial taken by owner without reporting an outcome"""
+        with self._lock:
+            if owner is not None and self._trial_owner is owner:
+                self._trial_owner = None
+                self._opened_at = time.monotonic() - self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_owner = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_owner = None
+            if self._failures >= self.fail_max:
+                self._opened_at = time.monotonic()
@@ -1,117 +1,422 @@
-import google.generativeai as genai
-from typing import Dict, Any, List, Optional
+from typing import TYPE_CHECKING, Dict, Any, Iterator, List, Optional, Sequence, Tuple, Union
+from collections import OrderedDict
+import asyncio
 import os
 import re
+import threading
+import time
 
-# Configure Gemini
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+from agents.gemini_client import GEMINI_API_KEY, CircuitBreaker, get_genai
+from agents.llm_cache import LLMCache
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
+# Gemini is configured on first use, through the client shared with the enhanced orchestrator
+GEMINI_EMBEDDING_MODEL = os.getenv("GEMINI_EMBEDDING_MODEL", "models/text-embedding-004")
+if not GEMINI_API_KEY:
+    print("Warning: No Gemini API key found")
+
+# One model per distinct system prompt, created on first use
+_MODELS: Dict[str, "genai.GenerativeModel"] = {}
+_MODEL_LOCK = threading.Lock()
+
+# Exact + semantic cache of Gemini answers, shared by all agents
+_RESPONSE_CACHE = LLMCache()
+
+# Prior (user, assistant) turns sent with each request, and how many sessions to remember them for
+_CONTEXT_TURNS = 3
+_SESSION_CONTEXT_SIZE = 1000
+
+# Async Gemini calls: requests per second allowed (with bursts up to the same
+# number; 0 or less turns rate limiting off), and how many batch items run at once
+GEMINI_RATE_LIMIT = float(os.getenv("GEMINI_RATE_LIMIT", "10"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "10"))
+
+
+class _TokenBucket:
+    """Async token bucket: acquire() waits until a request may be sent; a rate of 0 or less never waits"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+    
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+_RATE_LIMITER = _TokenBucket(GEMINI_RATE_LIMIT, max(GEMINI_RATE_LIMIT, 1))
+
+# Consecutive Gemini failures that open the breaker, and seconds it stays open
+# (answering with fallbacks) before trying Gemini again
+_BREAKER = CircuitBreaker(
+    fail_max=int(os.getenv("GEMINI_BREAKER_FAIL_MAX", "5")),
+    reset_timeout=float(os.getenv("GEMINI_BREAKER_RESET_TIMEOUT", "30")),
+)
+
+# Async requests whose top two route scores are closer than this go to both
+# agents at once; the first confident answer wins
+FAN_OUT_MARGIN = float(os.getenv("FAN_OUT_MARGIN", "0.2"))
+# Shortest answer accepted as confident when racing agents
+_MIN_CONFIDENT_LENGTH = 20
+# Canned or failed answers, which never win a race
+_UNCONFIDENT_MODES = frozenset({"fallback", "breaker_open", "error"})
+
+# Keywords are matched against the whole words of the lowercased request
+_TOKEN_RE = re.compile(r"[a-z]+")
+
+# Keywords an agent will accept a task on
+_CAN_HANDLE = {
+    "nlp_agent": frozenset({"analyze", "sentiment", "summarize", "text", "language", "meaning"}),
+    "code_agent": frozenset({"code", "python", "function", "programming", "debug", "write"}),
+    "data_agent": frozenset({"data", "analysis", "statistics", "chart", "visualization"}),
+}
+
+# The same, as one alternation regex per agent for standalone can_handle checks
+_CAN_HANDLE_RE = {
+    name: re.compile(r"\b(?:" + "|".join(sorted(keywords)) + r")\b", re.IGNORECASE)
+    for name, keywords in _CAN_HANDLE.items()
+}
+
+# Keywords that score routing, 0.2 per match
+_NLP_KEYWORDS = frozenset({"analyze", "sentiment", "text", "summarize", "language"})
+_CODE_KEYWORDS = frozenset({"code", "python", "function", "programming", "debug"})
+_DATA_KEYWORDS = frozenset({"data", "analysis", "statistics", "chart", "visualization"})
+
+# Each routing keyword owns one bit; a request and every agent's keyword sets
+# become int masks, and a score is the popcount of their intersection
+_KW_BIT = {
+    keyword: 1 << bit
+    for bit, keyword in enumerate(sorted(frozenset().union(*_CAN_HANDLE.values(), _NLP_KEYWORDS, _CODE_KEYWORDS, _DATA_KEYWORDS)))
+}
+
+def _mask_of(keywords) -> int:
+    mask = 0
+    for keyword in keywords:
+        mask |= _KW_BIT[keyword]
+    return mask
+
+# Routing table in priority order (earlier wins ties): agent key, mask it accepts tasks on, mask it scores on
+_ROUTES = (
+    ("nlp", _mask_of(_CAN_HANDLE["nlp_agent"]), _mask_of(_NLP_KEYWORDS)),
+    ("code", _mask_of(_CAN_HANDLE["code_agent"]), _mask_of(_CODE_KEYWORDS)),
+    ("data", _mask_of(_CAN_HANDLE["data_agent"]), _mask_of(_DATA_KEYWORDS)),
+)
+# No agent can score higher than matching every keyword in the largest set
+_ROUTE_CEILING = max(len(_NLP_KEYWORDS), len(_CODE_KEYWORDS), len(_DATA_KEYWORDS))
+
+# Leading commands that pick an agent explicitly, skipping keyword scoring
+_ROUTE_PREFIXES = {"/nlp": "nlp", "/code": "code", "/data": "data"}
+
+
+# Canned answers used when Gemini is unavailable
+_FALLBACK_SENTIMENT = "I can analyze sentiment! For the text you provided, I would typically examine positive/negative indicators, emotional tone, and context clues to determine if the sentiment is positive, negative, or neutral. To get detailed analysis, please add a Gemini API key."
+_FALLBACK_SUMMARIZE = "I can create summaries! I would identify key points, main themes, and essential information to create a concise summary. For detailed summarization, please add a Gemini API key."
+_FALLBACK_NLP = "I'm your NLP specialist! I can help with text analysis, sentiment analysis, summarization, and language processing. Add a Gemini API key for full functionality."
+_FALLBACK_PYTHON_FUNCTION = """I can help with Python functions! Here's a simple example:
+
+```python
+def add_two_numbers(a, b):
+    \"\"\"Add two numbers and return the result\"\"\"
+    return a + b
+
+# Usage example:
+result = add_two_numbers(5, 3)
+print(result)  # Output: 8
+```
+
+For more complex code generation, please add a Gemini API key."""
+_FALLBACK_CODE = "I'm your coding assistant! I can help with code generation, debugging, code review, and programming best practices. Add a Gemini API key for detailed assistance."
+_FALLBACK_DATA = "I'm your data analysis expert! I can help with data processing, statistical analysis, visualization recommendations, and data insights. Add a Gemini API key for detailed analysis and code examples."
+_FALLBACK_GENERIC = "I can help you with that, but I need an API key to provide detailed responses."
+
+# Fallback text by (agent, intent from _classify_fallback_intent)
+_FALLBACK_TEXT = {
+    ("nlp_agent", "sentiment"): _FALLBACK_SENTIMENT,
+    ("nlp_agent", "summarize"): _FALLBACK_SUMMARIZE,
+    ("nlp_agent", "general"): _FALLBACK_NLP,
+    ("code_agent", "python_function"): _FALLBACK_PYTHON_FUNCTION,
+    ("code_agent", "general_code"): _FALLBACK_CODE,
+    ("data_agent", "data"): _FALLBACK_DATA,
+}
+
+
+def _tokenize(text_lower: str) -> set:
+    """Split already-lowercased text into a set of alphabetic words"""
+    return set(_TOKEN_RE.findall(text_lower))
+
+def _keyword_mask(tokens: set) -> int:
+    """Bitmask of the routing keywords among tokens"""
+    mask = 0
+    for token in tokens:
+        mask |= _KW_BIT.get(token, 0)
+    return mask
+
+def _get_model(system_prompt: str) -> Optional["genai.GenerativeModel"]:
+    """Gemini model with system_prompt as its system instruction, so it is not resent in
+    every prompt; None when no API key is configured or it fails to initialize"""
+    if not GEMINI_API_KEY:
+        return None
+    
+    model = _MODELS.get(system_prompt)
+    if model is None:
+        with _MODEL_LOCK:
+            model = _MODELS.get(system_prompt)
+            if model is None:
+                try:
+                    model = get_genai().GenerativeModel('gemini-2.0-flash-lite', system_instruction=system_prompt)
+                except Exception as e:
+                    print(f"Gemini initialization error: {e}")
+                    return None
+                _MODELS[system_prompt] = model
+    
+    return model
+
+def _embed(text: str) -> Optional[List[float]]:
+    """Embed text for semantic cache lookups; None if embedding is unavailable"""
+    try:
+        result = get_genai().embed_content(model=GEMINI_EMBEDDING_MODEL, content=text, task_type="semantic_similarity")
+        return result["embedding"]
+    except Exception as e:
+        print(f"Embedding error: {e}")
+        return None
+
+def _classify_fallback_intent(agent_name: str, user_lower: str) -> str:
+    """Which canned answer an agent gives when Gemini is unavailable"""
+    if agent_name == "nlp_agent":
+        if "sentiment" in user_lower:
+            return "sentiment"
+        elif "summarize" in user_lower:
+            return "summarize"
+        return "general"
+    elif agent_name == "code_agent":
+        if "python" in user_lower and "function" in user_lower:
+            return "python_function"
+        return "general_code"
+    return "data"
+
+def _render_fallback(agent_name: str, intent: str) -> str:
+    """Fallback text for an agent and intent"""
+    return _FALLBACK_TEXT.get((agent_name, intent), _FALLBACK_GENERIC)
 
 class GeminiAgent:
+    # Fixed attribute layout; model is a property over the shared model cache
+    __slots__ = ("name", "capabilities", "system_prompt", "orchestrator", "stats", "_fallback_fn")
+    
     def __init__(self, name: str, capabilities: List[str], system_prompt: str, orchestrator: Optional['GeminiMultiAgentOrchestrator'] = None):
         self.name = name
         self.capabilities = capabilities
         self.system_prompt = system_prompt
         self.orchestrator = orchestrator
-
-        # Initialize Gemini model
-        try:
-            if GEMINI_API_KEY:
-                self.model = genai.GenerativeModel('gemini-2.0-flash-lite')
-            else:
-                self.model = None
-                print(f"Warning: No Gemini API key found for {name}")
-        except Exception as e:
-            print(f"Gemini initialization error for {name}: {e}")
-            self.model = None
+        self.stats = {"hits": 0, "semantic_hits": 0, "misses": 0}
+        
+        # Only this agent's fallback is ever needed, so pick it once
+        dispatch = {
+            "nlp_agent": self._nlp_fallback,
+            "code_agent": self._code_fallback,
+            "data_agent": self._data_fallback
+        }
+        self._fallback_fn = dispatch.get(self.name, self._generic_fallback)
+    
+    @property
+    def model(self) -> Optional["genai.GenerativeModel"]:
+        """Gemini model, initialized on the first request rather than at startup"""
+        return _get_model(self.system_prompt)
     
-    def can_handle(self, task: str) -> bool:
+    def can_handle(self, task: str, tokens: set = None) -> bool:
         """Check if agent can handle the task based on keywords"""
-        task_lower = task.lower()
-        
-        if self.name == "nlp_agent":
-            keywords = ["analyze", "sentiment", "summarize", "text", "language", "meaning"]
-            return any(keyword in task_lower for keyword in keywords)
-        elif self.name == "code_agent":
-            keywords = ["code", "python", "function", "programming", "debug", "write"]
-            return any(keyword in task_lower for keyword in keywords)
-        elif self.name == "data_agent":
-            keywords = ["data", "analysis", "statistics", "chart", "visualization"]
-            return any(keyword in task_lower for keyword in keywords)
+        if tokens is not None:
+            return not tokens.isdisjoint(_CAN_HANDLE.get(self.name, frozenset()))
         
-        return False
+        pattern = _CAN_HANDLE_RE.get(self.name)
+        return pattern is not None and pattern.search(task) is not None
     
-    def process(self, user_input: str, context: Dict[str, Any] = None) -> Dict[str, Any]:
-        """Process user input with Gemini"""
+    def process(self, user_input: str, context: Dict[str, Any] = None, history: Sequence[Tuple[str, str]] = (), user_lower: str = None) -> Dict[str, Any]:
+        """Process user input with Gemini, given the session's recent (user, assistant) turns"""
         
         # Fallback responses when Gemini is not available
-        if not self.model or not GEMINI_API_KEY:
-            fallback_responses = {
-                "nlp_agent": self._nlp_fallback(user_input),
-                "code_agent": self._code_fallback(user_input),
-                "data_agent": self._data_fallback(user_input)
-            }
-            return {
-                "success": True,
-                "agent": self.name,
-                "response": fallback_responses.get(self.name, "I can help you with that, but I need an API key to provide detailed responses."),
-                "metadata": {"mode": "fallback", "model": "none"}
-            }
+        model = self.model
+        if not model or not GEMINI_API_KEY:
+            return self._fallback_result(user_input, user_lower)
+        
+        cached, cache_key, namespace, embedding = self._lookup_cache(user_input, history)
+        if cached is not None:
+            return cached
+        
+        # Checked only once Gemini is really about to be called, so a cache hit
+        # never takes the half-open trial without reporting its outcome
+        if not _BREAKER.allow():
+            return self._fallback_result(user_input, user_lower, mode="breaker_open")
         
         try:
-            # Combine system prompt with user input
-            full_prompt = f"{self.system_prompt}\n\nUser: {user_input}\n\nAssistant:"
-            
-            response = self.model.generate_content(full_prompt)
+            response = model.generate_content(self._build_prompt(user_input, history))
+            _BREAKER.record_success()
+            return self._api_result(response.text, cache_key, namespace, embedding)
             
-            return {
-                "success": True,
-                "agent": self.name,
-                "response": response.text,
-                "metadata": {"model": "gemini-pro", "mode": "api"}
-            }
+        except Exception as e:
+            _BREAKER.record_failure()
+            return self._error_result(e)
+    
+    async def process_async(self, user_input: str, context: Dict[str, Any] = None, history: Sequence[Tuple[str, str]] = (), user_lower: str = None) -> Dict[str, Any]:
+        """Same as process, without blocking the event loop on Gemini"""
+        model = self.model
+        if not model or not GEMINI_API_KEY:
+            return self._fallback_result(user_input, user_lower)
+        
+        # The embedding call is a blocking request of its own
+        cached, cache_key, namespace, embedding = await asyncio.to_thread(self._lookup_cache, user_input, history)
+        if cached is not None:
+            return cached
+        
+        await _RATE_LIMITER.acquire()
+        task = asyncio.current_task()
+        if not _BREAKER.allow(owner=task):
+            return self._fallback_result(user_input, user_lower, mode="breaker_open")
+        
+        try:
+            response = await model.generate_content_async(self._build_prompt(user_input, history))
+            _BREAKER.record_success()
+            return self._api_result(response.text, cache_key, namespace, embedding)
             
+        except asyncio.CancelledError:
+            _BREAKER.release(task)
+            raise
         except Exception as e:
-            # Return helpful error message
-            return {
-                "success": False,
-                "agent": self.name,
-                "response": f"I encountered an error: {str(e)}. Using fallback response instead.",
-                "metadata": {"error": str(e), "mode": "error"}
-            }
+            _BREAKER.record_failure()
+            return self._error_result(e)
+    
+    def process_stream(self, user_input: str, history: Sequence[Tuple[str, str]] = (), user_lower: str = None) -> Iterator[str]:
+        """Yield the response text as Gemini generates it"""
+        model = self.model
+        if not model or not GEMINI_API_KEY:
+            yield self._fallback_fn(user_input, user_lower)
+            return
+        
+        cached, cache_key, namespace, embedding = self._lookup_cache(user_input, history)
+        if cached is not None:
+            yield cached["response"]
+            return
+        
+        trial = object()
+        if not _BREAKER.allow(owner=trial):
+            yield self._fallback_fn(user_input, user_lower)
+            return
+        
+        pieces = []
+        try:
+            for chunk in model.generate_content(self._build_prompt(user_input, history), stream=True):
+                pieces.append(chunk.text)
+                yield chunk.text
+        except GeneratorExit:
+            # The consumer stopped reading before the outcome was known
+            _BREAKER.release(trial)
+            raise
+        except Exception as e:
+            _BREAKER.record_failure()
+            yield self._error_result(e)["response"]
+            return
+        
+        _BREAKER.record_success()
+        _RESPONSE_CACHE.set(cache_key, "".join(pieces), embedding, namespace=namespace)
+    
+    def _lookup_cache(self, user_input: str, history: Sequence[Tuple[str, str]]):
+        """Returns (cached result or None, cache key, semantic namespace, embedding for storing)"""
+        # Exact repeat first, then a paraphrase of an earlier question. Both
+        # only match within the same prior conversation, so a follow-up like
+        # "make it shorter" is never answered from another session's context
+        ctx_hash = LLMCache.make_key(*(part for turn in history for part in turn)) if history else ""
+        cache_key = LLMCache.make_key(self.name, self.system_prompt, ctx_hash, user_input)
+        namespace = f"{self.name}:{ctx_hash}"
+        cached = _RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return self._cached_result(cached), cache_key, namespace, None
+        
+        embedding = _embed(user_input)
+        if embedding is not None:
+            cached = _RESPONSE_CACHE.semantic_lookup(embedding, namespace=namespace)
+            if cached is not None:
+                self.stats["semantic_hits"] += 1
+                return self._cached_result(cached), cache_key, namespace, embedding
+        
+        self.stats["misses"] += 1
+        return None, cache_key, namespace, embedding
     
-    def _nlp_fallback(self, user_input: str) -> str:
+    def _build_prompt(self, user_input: str, history: Sequence[Tuple[str, str]]) -> Union[str, List[Dict[str, Any]]]:
+        """Contents for Gemini: the user input alone, or preceded by the recent conversation"""
+        if not history:
+            return user_input
+        
+        contents = []
+        for user, assistant in history:
+            contents.append({"role": "user", "parts": [user]})
+            contents.append({"role": "model", "parts": [assistant]})
+        contents.append({"role": "user", "parts": [user_input]})
+        return contents
+    
+    def _api_result(self, text: str, cache_key: str, namespace: str, embedding: Optional[List[float]]) -> Dict[str, Any]:
+        _RESPONSE_CACHE.set(cache_key, text, embedding, namespace=namespace)
+        return {
+            "success": True,
+            "agent": self.name,
+            "response": text,
+            "metadata": {"model": "gemini-pro", "mode": "api"}
+        }
+    
+    def _cached_result(self, response: str) -> Dict[str, Any]:
+        return {
+            "success": True,
+            "agent": self.name,
+            "response": response,
+            "metadata": {"model": "gemini-pro", "mode": "cache"}
+        }
+    
+    def _error_result(self, e: Exception) -> Dict[str, Any]:
+        # Return helpful error message
+        return {
+            "success": False,
+            "agent": self.name,
+            "response": f"I encountered an error: {str(e)}. Using fallback response instead.",
+            "metadata": {"error": str(e), "mode": "error"}
+        }
+    
+    def _fallback_result(self, user_input: str, user_lower: str = None, mode: str = "fallback") -> Dict[str, Any]:
+        return {
+            "success": True,
+            "agent": self.name,
+            "response": self._fallback_fn(user_input, user_lower),
+            "metadata": {"mode": mode, "model": "none"}
+        }
+    
+    def _nlp_fallback(self, user_input: str, user_lower: str = None) -> str:
         """Fallback response for NLP tasks"""
-        if "sentiment" in user_input.lower():
-            return "I can analyze sentiment! For the text you provided, I would typically examine positive/negative indicators, emotional tone, and context clues to determine if the sentiment is positive, negative, or neutral. To get detailed analysis, please add a Gemini API key."
-        elif "summarize" in user_input.lower():
-            return "I can create summaries! I would identify key points, main themes, and essential information to create a concise summary. For detailed summarization, please add a Gemini API key."
-        else:
-            return "I'm your NLP specialist! I can help with text analysis, sentiment analysis, summarization, and language processing. Add a Gemini API key for full functionality."
-    
-    def _code_fallback(self, user_input: str) -> str:
+        if user_lower is None:
+            user_lower = user_input.lower()
+        return _render_fallback("nlp_agent", _classify_fallback_intent("nlp_agent", user_lower))
+    
+    def _code_fallback(self, user_input: str, user_lower: str = None) -> str:
         """Fallback response for coding tasks"""
-        if "python" in user_input.lower() and "function" in user_input.lower():
-            return """I can help with Python functions! Here's a simple example:
-
-```python
-def add_two_numbers(a, b):
-    \"\"\"Add two numbers and return the result\"\"\"
-    return a + b
-
-# Usage example:
-result = add_two_numbers(5, 3)
-print(result)  # Output: 8
-```
-
-For more complex code generation, please add a Gemini API key."""
-        else:
-            return "I'm your coding assistant! I can help with code generation, debugging, code review, and programming best practices. Add a Gemini API key for detailed assistance."
+        if user_lower is None:
+            user_lower = user_input.lower()
+        return _render_fallback("code_agent", _classify_fallback_intent("code_agent", user_lower))
     
-    def _data_fallback(self, user_input: str) -> str:
+    def _data_fallback(self, user_input: str, user_lower: str = None) -> str:
         """Fallback response for data tasks"""
-        return "I'm your data analysis expert! I can help with data processing, statistical analysis, visualization recommendations, and data insights. Add a Gemini API key for detailed analysis and code examples."
+        return _render_fallback("data_agent", "data")
+    
+    def _generic_fallback(self, user_input: str, user_lower: str = None) -> str:
+        return "I can help you with that, but I need an API key to provide detailed responses."
 
 class GeminiMultiAgentOrchestrator:
     def __init__(self):
@@ -136,72 +441,197 @@ class GeminiMultiAgentOrchestrator:
                 orchestrator=self
             )
         }
+        
+        # session_id -> last few (user, assistant) turns, least recently used first
+        self._session_context: "OrderedDict[str, List[Tuple[str, str]]]" = OrderedDict()
     
     def process_request(self, user_input: str, session_id: str = None) -> Dict[str, Any]:
         """Process user request through appropriate agent"""
         try:
-            # Route to best agent
-            selected_agent = self._route_request(user_input)
+            # Route to best agent; the request is scanned once for all keyword sets
+            selected_agent, user_input, user_lower, _ = self._pick_route(user_input)
             
             # Process with selected agent
             if selected_agent in self.agents:
-                response = self.agents[selected_agent].process(user_input)
+                history = self._get_session_context(session_id)
+                response = self.agents[selected_agent].process(user_input, history=history, user_lower=user_lower)
+                return self._request_result(selected_agent, response, session_id, user_input)
+            else:
+                return self._routing_failed_result()
                 
-                return {
-                    "success": response.get("success", True),
-                    "final_response": response.get("response", "No response generated"),
-                    "agent_responses": [response],
-                    "metadata": {
-                        "selected_agent": selected_agent,
-                        "agents_consulted": [selected_agent],
-                        "routing_decision": {"selected": selected_agent}
-                    }
-                }
+        except Exception as e:
+            return self._system_error_result(e)
+    
+    async def process_request_async(self, user_input: str, session_id: str = None) -> Dict[str, Any]:
+        """Async version of process_request; ambiguous requests are raced across the top two agents"""
+        try:
+            selected_agent, user_input, user_lower, mask = self._pick_route(user_input)
+            history = self._get_session_context(session_id)
+            
+            if mask is not None:
+                ranked = sorted(self._score_routes(mask).items(), key=lambda item: item[1], reverse=True)
+                # Rounded so 0.6 - 0.4 counts as a full keyword apart
+                if len(ranked) >= 2 and round(ranked[0][1] - ranked[1][1], 6) < FAN_OUT_MARGIN:
+                    candidates = [ranked[0][0], ranked[1][0]]
+                    selected_agent, response = await self._race_agents(candidates, user_input, user_lower, history)
+                    return self._request_result(selected_agent, response, session_id, user_input, candidates)
+            
+            if selected_agent in self.agents:
+                response = await self.agents[selected_agent].process_async(user_input, history=history, user_lower=user_lower)
+                return self._request_result(selected_agent, response, session_id, user_input)
             else:
-                return {
-                    "success": False,
-                    "final_response": "Unable to route your request. Please try rephrasing.",
-                    "metadata": {"error": "routing_failed"}
-                }
+                return self._routing_failed_result()
                 
         except Exception as e:
-            return {
-                "success": False,
-                "final_response": f"System error occurred. Please try again. Details: {str(e)}",
-                "metadata": {"error": str(e)}
+            return self._system_error_result(e)
+    
+    async def _race_agents(self, candidates: List[str], user_input: str, user_lower: str, history: Tuple[Tuple[str, str], ...]) -> Tuple[str, Dict[str, Any]]:
+        """Run agents concurrently and return the first confident (agent, response), cancelling the
+        rest except one holding the breaker's half-open trial, which is awaited so its outcome is recorded"""
+        tasks = {
+            asyncio.create_task(self.agents[agent_name].process_async(user_input, history=history, user_lower=user_lower)): agent_name
+            for agent_name in candidates
+        }
+        pending = set(tasks)
+        first = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = (tasks[task], task.result())
+                    if self._is_confident(result[1]):
+                        return result
+                    if first is None:
+                        first = result
+            return first
+        finally:
+            trial = {task for task in pending if _BREAKER.holds_trial(task)}
+            for task in pending - trial:
+                task.cancel()
+            if trial:
+                await asyncio.wait(trial)
+    
+    @staticmethod
+    def _is_confident(response: Dict[str, Any]) -> bool:
+        """Quick check that a racing agent's answer is good enough to return"""
+        return (
+            response.get("success", False)
+            and response.get("metadata", {}).get("mode") not in _UNCONFIDENT_MODES
+            and len(response.get("response", "")) >= _MIN_CONFIDENT_LENGTH
+        )
+    
+    def process_request_stream(self, user_input: str, session_id: str = None) -> Iterator[Dict[str, str]]:
+        """Stream the routed agent's response as {"delta", "agent"} chunks"""
+        selected_agent, user_input, user_lower, _ = self._pick_route(user_input)
+        agent = self.agents[selected_agent]
+        
+        pieces = []
+        for delta in agent.process_stream(user_input, history=self._get_session_context(session_id), user_lower=user_lower):
+            pieces.append(delta)
+            yield {"delta": delta, "agent": selected_agent}
+        
+        self._remember_turn(session_id, user_input, "".join(pieces))
+    
+    async def process_batch_async(self, inputs: List[str], max_concurrency: int = GEMINI_MAX_CONCURRENCY) -> List[Dict[str, Any]]:
+        """Process independent requests concurrently; results are in input order"""
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run(user_input: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.process_request_async(user_input)
+        
+        return await asyncio.gather(*(run(user_input) for user_input in inputs))
+    
+    def _request_result(self, selected_agent: str, response: Dict[str, Any], session_id: Optional[str], user_input: str, agents_consulted: List[str] = None) -> Dict[str, Any]:
+        if response.get("success", True):
+            self._remember_turn(session_id, user_input, response.get("response", ""))
+        
+        return {
+            "success": response.get("success", True),
+            "final_response": response.get("response", "No response generated"),
+            "agent_responses": [response],
+            "metadata": {
+                "selected_agent": selected_agent,
+                "agents_consulted": agents_consulted or [selected_agent],
+                "winner": selected_agent,
+                "routing_decision": {"selected": selected_agent}
             }
+        }
     
-    def _route_request(self, user_input: str) -> str:
-        """Route request to most appropriate agent"""
-        user_lower = user_input.lower()
+    def _routing_failed_result(self) -> Dict[str, Any]:
+        return {
+            "success": False,
+            "final_response": "Unable to route your request. Please try rephrasing.",
+            "metadata": {"error": "routing_failed"}
+        }
+    
+    def _system_error_result(self, e: Exception) -> Dict[str, Any]:
+        return {
+            "success": False,
+            "final_response": f"System error occurred. Please try again. Details: {str(e)}",
+            "metadata": {"error": str(e)}
+        }
+    
+    def _get_session_context(self, session_id: Optional[str]) -> Tuple[Tuple[str, str], ...]:
+        """Recent turns of a session, oldest first"""
+        if session_id is None or session_id not in self._session_context:
+            return ()
         
-        # Score each agent
-        scores = {}
-        for agent_name, agent in self.agents.items():
-            if agent.can_handle(user_input):
-                scores[agent_name] = self._calculate_score(user_input, agent_name)
+        self._session_context.move_to_end(session_id)
+        return tuple(self._session_context[session_id])
+    
+    def _remember_turn(self, session_id: Optional[str], user_input: str, response: str):
+        if session_id is None:
+            return
+        
+        turns = self._session_context.setdefault(session_id, [])
+        turns.append((user_input, response))
+        del turns[:-_CONTEXT_TURNS]
+        self._session_context.move_to_end(session_id)
+        while len(self._session_context) > _SESSION_CONTEXT_SIZE:
+            self._session_context.popitem(last=False)
+    
+    def _pick_route(self, user_input: str) -> Tuple[str, str, str, Optional[int]]:
+        """Returns (agent key, input to send it, that input lowercased, keyword mask or None when scoring was skipped)"""
+        # The only place the request is lowercased; everything downstream reuses it
+        parts = user_input.split(None, 1)
+        if parts:
+            command = parts[0].lower()
+            if command in _ROUTE_PREFIXES:
+                if len(parts) > 1:
+                    return _ROUTE_PREFIXES[command], parts[1], parts[1].lower(), None
+                return _ROUTE_PREFIXES[command], user_input, command, None
         
-        # Return highest scoring agent or default
-        if scores:
-            return max(scores.items(), key=lambda x: x[1])[0]
-        else:
-            return "nlp"  # Default to NLP for general queries
-    
-    def _calculate_score(self, user_input: str, agent_name: str) -> float:
-        """Calculate relevance score for agent"""
         user_lower = user_input.lower()
+        tokens = _tokenize(user_lower)
+        if len(tokens) <= 1:
+            return "nlp", user_input, user_lower, None  # "hi", "thanks": nothing worth scoring
         
-        if agent_name == "nlp":
-            keywords = ["analyze", "sentiment", "text", "summarize", "language"]
-            return sum(0.2 for keyword in keywords if keyword in user_lower)
-        elif agent_name == "code":
-            keywords = ["code", "python", "function", "programming", "debug"]
-            return sum(0.2 for keyword in keywords if keyword in user_lower)
-        elif agent_name == "data":
-            keywords = ["data", "analysis", "statistics", "chart", "visualization"]
-            return sum(0.2 for keyword in keywords if keyword in user_lower)
+        mask = _keyword_mask(tokens)
+        return self._route_request(mask), user_input, user_lower, mask
+    
+    def _score_routes(self, mask: int) -> Dict[str, float]:
+        """Score of every agent that accepts the request, 0.2 per matched keyword"""
+        return {
+            agent_name: 0.2 * (mask & scored).bit_count()
+            for agent_name, accepts, scored in _ROUTES
+            if mask & accepts
+        }
+    
+    def _route_request(self, mask: int) -> str:
+        """Route request to most appropriate agent from its keyword mask"""
+        best_agent, best_score = "nlp", -1  # Default to NLP for general queries
+        for agent_name, accepts, scored in _ROUTES:
+            if not mask & accepts:
+                continue
+            
+            score = (mask & scored).bit_count()
+            if score > best_score:
+                best_agent, best_score = agent_name, score
+                if score == _ROUTE_CEILING:
+                    break
         
-        return 0.0
+        return best_agent
     
     def get_agent_status(self) -> Dict[str, Any]:
         """Get status of all agents"""
@@ -220,221 +650,3 @@ class GeminiMultiAgentOrchestrator:
             ],
             "total_agents": len(self.agents)
         }
-    
-    def _get_fallback_response(self, agent_type: str, user_input: str) -> str:
-        """Generate natural, conversational responses with proper formatting"""
-        user_lower = user_input.lower()
-        
-        if agent_type == "nlp":
-            return self._nlp_enhanced_fallback(user_input, user_lower)
-        elif agent_type == "code":
-            return self._code_enhanced_fallback(user_input, user_lower)
-        else:
-            return self._data_enhanced_fallback(user_input, user_lower)
-
-    def _nlp_enhanced_fallback(self, user_input: str, user_lower: str) -> str:
-        """Generalized NLP agent - handles general questions, facts, and text analysis"""
-        
-        # For general questions (what, when, where, who, why, how)
-        if any(word in user_lower[:30] for word in ["when is", "what is", "where is", "who is", "why", "how"]):
-            return f"""I understand you're asking about: **{user_input}**
-
-I'm an AI assistant designed to help with various tasks, but I don't have access to real-time information or current events. For questions about:
-
-**Current Events & Schedules**: I'd recommend checking:
-• Official sports websites (ESPN, ICC, etc.)
-• News sources (BBC, CNN, etc.)
-• Official tournament websites
-
-**What I can help you with:**
-• **Text Analysis**: Sentiment analysis, content review, writing assistance
-• **General Knowledge**: Historical facts, scientific concepts, explanations
-• **Language Tasks**: Grammar checking, content creation, summarization
-• **Research Guidance**: How to find reliable sources and information
-
-**For your specific question**, I'd suggest checking the official Asia Cup cricket website or sports news sources for the most current schedule information.
-
-Would you like me to help you with text analysis, writing, or explaining how to research this topic effectively?"""
-
-        # For sentiment analysis requests
-        if "sentiment" in user_lower:
-            return self._analyze_sentiment_intelligently(user_input, user_lower)
-        
-        # For summarization requests
-        if any(word in user_lower for word in ["summarize", "summary", "tldr"]):
-            return """**Text Summarization Service**
-
-I can help you create clear, concise summaries of any text content. Here's how:
-
-**What I Can Summarize:**
-• Articles, reports, and documents
-• Long emails or messages
-• Research papers or academic content
-• Meeting notes or transcripts
-
-**My Approach:**
-• Identify key points and main arguments
-• Preserve important details and context
-• Create structured, easy-to-read summaries
-• Maintain the original tone and intent
-
-**To Get Started:**
-Simply paste the text you'd like summarized, and I'll create a concise overview highlighting the most important information.
-
-What content would you like me to summarize?"""
-
-        # Default general assistant response
-        return f"""I'm here to help you with: **{user_input}**
-
-As a general AI assistant, I can help with a wide range of tasks:
-
-**Text & Language:**
-• Writing assistance and content creation
-• Grammar and style checking
-• Text analysis and sentiment evaluation
-
-**Information & Research:**
-• Explaining concepts and topics
-• Research methodology guidance
-• Fact-checking strategies
-
-**Problem Solving:**
-• Breaking down complex questions
-• Providing step-by-step guidance
-• Offering multiple perspectives
-
-For your specific question, I'd be happy to help if you can provide more context or clarify what type of assistance you're looking for.
-
-How can I best assist you today?"""
-
-    def _analyze_sentiment_intelligently(self, user_input: str, user_lower: str) -> str:
-        """Smart sentiment analysis that actually analyzes the provided text"""
-        
-        # Extract the text to analyze (look for quotes or "text:" patterns)
-        quoted_text = re.findall(r'"([^"]*)"', user_input)
-        if quoted_text:
-            text_to_analyze = quoted_text[0]
-        else:
-            # Look for text after "text:" or similar patterns
-            text_match = re.search(r'text[:\s]+(.+)', user_input, re.IGNORECASE)
-            if text_match:
-                text_to_analyze = text_match.group(1).strip()
-            else:
-                text_to_analyze = user_input
-        
-        # Perform actual sentiment analysis
-        positive_words = ["love", "great", "awesome", "amazing", "excellent", "fantastic", "wonderful", "good", "like", "happy", "perfect", "best"]
-        negative_words = ["hate", "bad", "terrible", "awful", "horrible", "disgusting", "worst", "dislike", "angry", "disappointed", "poor"]
-        
-        text_lower = text_to_analyze.lower()
-        positive_count = sum(1 for word in positive_words if word in text_lower)
-        negative_count = sum(1 for word in negative_words if word in text_lower)
-        
-        # Determine sentiment
-        if negative_count > positive_count:
-            sentiment = "Negative"
-            confidence = "High" if negative_count > 1 else "Moderate"
-            indicators = [word for word in negative_words if word in text_lower]
-        elif positive_count > negative_count:
-            sentiment = "Positive" 
-            confidence = "High" if positive_count > 1 else "Moderate"
-            indicators = [word for word in positive_words if word in text_lower]
-        else:
-            sentiment = "Neutral"
-            confidence = "Moderate"
-            indicators = []
-
-        return f"""**Sentiment Analysis Results**
-
-**Text Analyzed**: "{text_to_analyze}"
-
-**Findings:**
-• **Overall Sentiment**: {sentiment}
-• **Confidence Level**: {confidence}
-• **Key Indicators**: {', '.join(indicators) if indicators else 'Neutral language patterns'}
-
-**Analysis:**
-{self._get_sentiment_explanation(sentiment, indicators, text_to_analyze)}
-
-**Note**: This analysis is based on keyword detection and linguistic patterns. For more nuanced sentiment analysis including context, sarcasm detection, and emotional intensity, more advanced NLP models would provide deeper insights."""
-
-    def _get_sentiment_explanation(self, sentiment: str, indicators: list, text: str) -> str:
-        """Generate explanation for sentiment analysis"""
-        if sentiment == "Positive":
-            return f"The text expresses positive sentiment through words like '{', '.join(indicators[:3])}'. This suggests satisfaction, approval, or positive emotional response."
-        elif sentiment == "Negative":
-            return f"The text shows negative sentiment with words like '{', '.join(indicators[:3])}'. This indicates dissatisfaction, criticism, or negative emotional response."
-        else:
-            return "The text appears neutral with balanced or factual language. No strong emotional indicators were detected in either direction."
-    
-    def _code_enhanced_fallback(self, user_input: str, user_lower: str) -> str:
-        """Generalized code agent - handles programming and technical questions"""
-        
-        # Check if this is actually a coding request
-        coding_indicators = ["function", "code", "program", "script", "python", "javascript", "algorithm", "debug", "syntax"]
-        is_coding_request = any(indicator in user_lower for indicator in coding_indicators)
-        
-        if not is_coding_request:
-            return f"""I'm the **Code Agent**, but I notice your question might not be programming-related: **"{user_input}"**
-
-**What I specialize in:**
-• Programming and software development
-• Algorithm implementation and optimization
-• Code debugging and troubleshooting
-• Technical problem solving
-
-**For your question**, you might want to try:
-• **General questions**: Ask our NLP agent
-• **Data analysis**: Ask our Data agent
-• **Programming help**: I'm here to help!
-
-**If you need coding assistance**, I can help with:
-• Writing functions and algorithms
-• Debugging code issues
-• Code optimization and best practices
-• Technical explanations and tutorials
-
-Would you like me to help with a programming task instead?"""
-
-        # Handle specific coding requests
-        if "python" in user_lower and any(word in user_lower for word in ["add", "sum", "plus", "two numbers"]):
-            return '''**Python Function: Adding Two Numbers**
-
-Here's a clean, professional implementation:
-
-```python
-def add_two_numbers(a, b):
-    """
-    Add two numbers and return the result.
-    
-    Args:
-        a (int or float): First number
-        b (int or float): Second number
-    
-    Returns:
-        int or float: Sum of a and b
-    
-    Examples:
-        >>> add_two_numbers(5, 3)
-        8
-        >>> add_two_numbers(2.5, 3.7)
-        6.2
-    """
-    return a + b
-
-# Alternative with error handling
-def add_numbers_safe(a, b):
-    """
-    Add two numbers with type checking and error handling.
-    """
-    try:
-        # Convert to numbers if they're strings
-        if isinstance(a, str):
-            a = float(a) if '.' in a else int(a)
-        if isinstance(b, str):
-            b = float(b) if '.' in b else int(b)
-        
-        return a + b
-    except (ValueError, TypeError) as e:
-        return f"Error: Cannot add {a} and {b} - {str(e)}"
-'''
\ No newline at end of file
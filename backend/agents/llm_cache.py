@@ -0,0 +1,124 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+# Seconds a cached response stays valid; 0 keeps entries until evicted
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+
+
+class LLMCache:
+    """Two-tier response cache: exact prompt hash first, then cosine similarity
+    over stored embeddings. Embeddings are grouped by namespace so that e.g.
+    one agent's answers are never served for another agent's prompt."""
+
+    def __init__(self, maxsize: int = SEMANTIC_CACHE_SIZE, threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: float = LLM_CACHE_TTL):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (value, namespace of its embedding or None, monotonic expiry or None)
+        self._entries: "OrderedDict[str, Tuple[Any, Optional[str], Optional[float]]]" = OrderedDict()
+        # namespace -> (row keys, unit-normalised float32 matrix)
+        self._index: Dict[str, Tuple[List[str], np.ndarray]] = {}
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """Stable SHA-256 key for a prompt and anything it depends on"""
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def semantic_lookup(self, embedding: Sequence[float], namespace: str = "") -> Optional[Any]:
+        """Return the cached value whose embedding is most similar, if above threshold"""
+        query = self._normalise(embedding)
+        if query is None:
+            return None
+
+        with self._lock:
+            keys, matrix = self._index.get(namespace, ((), None))
+            if not keys or matrix.shape[1] != query.shape[0]:
+                return None
+
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+
+            key = keys[best]
+            entry = self._entries[key]
+            if self._expired(entry):
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: Any, embedding: Optional[Sequence[float]] = None, namespace: str = ""):
+        vector = self._normalise(embedding) if embedding is not None else None
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = (value, self._entries[key][1], expires_at)
+                self._entries.move_to_end(key)
+                return
+
+            self._entries[key] = (value, namespace if vector is not None else None, expires_at)
+            if vector is not None:
+                self._add_vector(namespace, key, vector)
+
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    @staticmethod
+    def _expired(entry: Tuple[Any, Optional[str], Optional[float]]) -> bool:
+        return entry[2] is not None and entry[2] <= time.monotonic()
+
+    def _discard(self, key: str):
+        _, namespace, _ = self._entries.pop(key)
+        if namespace is not None:
+            self._remove_vector(namespace, key)
+
+    def _add_vector(self, namespace: str, key: str, vector: np.ndarray):
+        keys, matrix = self._index.get(namespace, ([], None))
+        if matrix is not None and matrix.shape[1] != vector.shape[0]:
+            # Embedding model changed; drop the stale vectors for this namespace
+            keys, matrix = [], None
+        keys.append(key)
+        matrix = vector[np.newaxis, :] if matrix is None else np.vstack((matrix, vector))
+        self._index[namespace] = (keys, matrix)
+
+    def _remove_vector(self, namespace: str, key: str):
+        keys, matrix = self._index.get(namespace, ([], None))
+        if key not in keys:
+            return
+        row = keys.index(key)
+        del keys[row]
+        if keys:
+            self._index[namespace] = (keys, np.delete(matrix, row, axis=0))
+        else:
+            del self._index[namespace]
+
+    @staticmethod
+    def _normalise(embedding: Sequence[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if vector.ndim != 1 or norm == 0.0:
+            return None
+        return vector / norm
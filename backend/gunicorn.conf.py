@@ -0,0 +1,18 @@
+import os
+
+# Production entrypoint: gunicorn supervises uvicorn workers, each with its own
+# uvloop event loop (uvicorn picks uvloop/httptools when installed)
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+# A fixed default rather than cpu*2+1: each worker holds its own DB pool, and
+# models/database.py splits DB_MAX_CONNECTIONS by this same WEB_CONCURRENCY
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+# State kept in process memory is per worker, not shared: the agent
+# processing status behind /api/agents/status, the LLM response caches and
+# in-flight request coalescing, and the short-lived status snapshots. Status
+# responses therefore describe whichever worker answered (see worker_pid in
+# the payload), and cache hit rates drop as workers are added. Set
+# WEB_CONCURRENCY=1 where a single consistent view matters more than cores
+# SSE replies stay open while the model generates
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+keepalive = 5
@@ -1,24 +1,34 @@
 from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from typing import List, Dict, Optional, Any
-import shutil
+import json
+import asyncio
+import codecs
+import functools
 import mimetypes
 from pathlib import Path
 from datetime import datetime
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 import uuid
 import os
 from models.database import get_db, Conversation, AgentExecution
 from agents.enhanced_orchestrator import EnhancedGeminiOrchestrator
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, delete, insert, case
+from sqlalchemy.ext.asyncio import AsyncSession
 import psutil
 import time
 import uvicorn
+import aiofiles
+import orjson
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
 from fastapi.staticfiles import StaticFiles
 
-from models.database import get_db, Conversation, AgentExecution, ChatSession
+from models.database import get_db, SessionLocal, Conversation, AgentExecution, ChatSession, FileUpload
 
 from agents.brief_synthesizer.router import router as brief_router
 from agents.ad_variation.router import router as ads_router
@@ -27,21 +37,56 @@ from agents.smart_invoice.router import router as invoice_router
 
 # File upload configuration
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_PREVIEW_BYTES = 5000
 ALLOWED_EXTENSIONS = {
     'text': ['.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.xml', '.csv'],
     'documents': ['.pdf', '.doc', '.docx'],
     'data': ['.csv', '.json', '.xlsx', '.xls'],
     'images': ['.png', '.jpg', '.jpeg', '.gif']
 }
+# Flattened once at import: extension -> category, and every allowed extension
+# (.csv and .json sit in two categories; built in reverse so the first one
+# listed wins, as before)
+EXTENSION_CATEGORIES = {
+    ext: category
+    for category, extensions in reversed(ALLOWED_EXTENSIONS.items())
+    for ext in extensions
+}
+ALL_ALLOWED_EXTENSIONS = frozenset(EXTENSION_CATEGORIES)
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
 app = FastAPI(
     title="Multi-Agent Platform",
     description="Collaborative Multi-Agent System for Task Specialization",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+class UploadSizeLimitMiddleware:
+    """Reject uploads whose declared Content-Length is over the limit before any body is read"""
+    
+    def __init__(self, app, max_body_size: int):
+        self.app = app
+        self.max_body_size = max_body_size
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/api/upload":
+            content_length = dict(scope["headers"]).get(b"content-length")
+            if content_length and content_length.isdigit() and int(content_length) > self.max_body_size:
+                response = ORJSONResponse(
+                    {"detail": f"File size exceeds {MAX_FILE_SIZE // (1024*1024)}MB limit"}, status_code=413
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+# Multipart framing adds a little on top of the file itself; chunked uploads
+# without a Content-Length are still capped while streaming to disk. Added
+# before CORS so the 413 still carries CORS headers
+app.add_middleware(UploadSizeLimitMiddleware, max_body_size=MAX_FILE_SIZE + UPLOAD_CHUNK_SIZE)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -52,9 +97,126 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class NonStreamingGZipMiddleware(GZipMiddleware):
+    """GZip that leaves streaming endpoints alone; compressing SSE would buffer events"""
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith("/stream"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Compress larger JSON payloads such as session and chat history
+app.add_middleware(NonStreamingGZipMiddleware, minimum_size=1024)
+
 # Initialize the orchestrator
 orchestrator = EnhancedGeminiOrchestrator()
 
+# Dashboards poll the status endpoints; serve them from a short-lived snapshot
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "1"))
+MEMORY_CACHE_TTL = 0.5
+
+def ttl_cached(ttl: float):
+    """Cache a zero-argument function's result for ttl seconds"""
+    def decorator(fn):
+        cached = (0.0, None)  # (monotonic expiry, value)
+        
+        @functools.wraps(fn)
+        def wrapper():
+            nonlocal cached
+            now = time.monotonic()
+            if now >= cached[0]:
+                cached = (now + ttl, fn())
+            return cached[1]
+        return wrapper
+    return decorator
+
+# Redis cache for serialized responses; disabled when REDIS_URL is unset
+REDIS_URL = os.getenv("REDIS_URL", "")
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "300"))
+ANALYTICS_CACHE_TTL = int(os.getenv("ANALYTICS_CACHE_TTL", "30"))
+ANALYTICS_CACHE_KEY = "analytics"
+SESSION_STREAM_BATCH = 200  # rows per fetch for the NDJSON session stream
+redis_client = aioredis.from_url(REDIS_URL) if REDIS_URL else None
+
+def session_cache_key(session_id: str) -> str:
+    return f"sess:{session_id}"
+
+def session_version_key(session_id: str) -> str:
+    return f"sessver:{session_id}"
+
+# Stores a session snapshot only if the session's version is still the one the
+# reader saw before querying, so a turn committed meanwhile is never hidden
+_SET_IF_VERSION = redis_client.register_script("""
+if (redis.call('GET', KEYS[1]) or '') == ARGV[1] then
+    redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+end
+""") if redis_client is not None else None
+
+async def cache_get(key: str) -> Optional[bytes]:
+    if redis_client is None:
+        return None
+    try:
+        return await redis_client.get(key)
+    except RedisError as e:
+        print(f"Warning: cache read failed: {e}")
+        return None
+
+async def cache_set(key: str, payload, ttl: int):
+    if redis_client is None:
+        return
+    try:
+        await redis_client.set(key, payload, ex=ttl)
+    except RedisError as e:
+        print(f"Warning: cache write failed: {e}")
+
+async def get_session_version(session_id: str) -> str:
+    """Version of a session's history; read before querying it for the cache"""
+    version = await cache_get(session_version_key(session_id))
+    return version.decode() if version is not None else ""
+
+async def cache_session_snapshot(session_id: str, version: str, payload):
+    """Cache a session's history unless it changed since version was read"""
+    if _SET_IF_VERSION is None:
+        return
+    try:
+        await _SET_IF_VERSION(
+            keys=[session_version_key(session_id), session_cache_key(session_id)],
+            args=[version, payload, SESSION_CACHE_TTL]
+        )
+    except RedisError as e:
+        print(f"Warning: cache write failed: {e}")
+
+async def invalidate_session_cache(session_id: str):
+    """Drop a session's cached history; call after committing changes to it"""
+    if redis_client is None:
+        return
+    try:
+        # Bumping the version also stops readers that queried before the
+        # commit from caching what they read
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.incr(session_version_key(session_id))
+            pipe.expire(session_version_key(session_id), SESSION_CACHE_TTL)
+            pipe.delete(session_cache_key(session_id))
+            await pipe.execute()
+    except RedisError as e:
+        print(f"Warning: session cache invalidation failed: {e}")
+
+@ttl_cached(STATUS_CACHE_TTL)
+def cached_agent_status() -> Dict[str, Any]:
+    # Agent status lives in this worker's memory; say which worker it is from
+    return {**orchestrator.get_agent_status(), "worker_pid": os.getpid()}
+
+@app.on_event("startup")
+async def prime_cpu_percent():
+    # cpu_percent(interval=None) reports usage since the previous call; this
+    # first call sets the baseline so /system/status never has to sleep
+    psutil.cpu_percent(interval=None)
+
+@ttl_cached(MEMORY_CACHE_TTL)
+def cached_memory_snapshot():
+    return psutil.virtual_memory()
+
 os.makedirs("uploads", exist_ok=True)
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
@@ -64,40 +226,137 @@ app.include_router(invoice_router)
 
 def get_file_type(filename: str) -> str:
     """Determine file type category"""
-    ext = Path(filename).suffix.lower()
-    for category, extensions in ALLOWED_EXTENSIONS.items():
-        if ext in extensions:
-            return category
-    return 'unknown'
+    return EXTENSION_CATEGORIES.get(Path(filename).suffix.lower(), 'unknown')
 
 def validate_file(file: UploadFile) -> tuple[bool, str]:
     """Validate uploaded file"""
-    if file.size > MAX_FILE_SIZE:
-        return False, f"File size exceeds {MAX_FILE_SIZE // (1024*1024)}MB limit"
-    
+    # Size is enforced by UploadSizeLimitMiddleware and while streaming to disk
     ext = Path(file.filename).suffix.lower()
-    all_allowed = []
-    for extensions in ALLOWED_EXTENSIONS.values():
-        all_allowed.extend(extensions)
-    
-    if ext not in all_allowed:
+    if ext not in ALL_ALLOWED_EXTENSIONS:
         return False, f"File type {ext} not supported"
     
     return True, "Valid"
 
-async def process_uploaded_file(file: UploadFile) -> tuple[str, str]:
-    """Process uploaded file and extract content"""
+async def save_uploaded_file(file: UploadFile, file_path: Path) -> tuple[str, int]:
+    """Stream an upload to disk in fixed-size chunks; returns (content preview, size)"""
+    total = 0
+    preview = bytearray()
     try:
-        content = await file.read()
-        file.file.seek(0)  # Reset file pointer
-        
-        try:
-            text_content = content.decode('utf-8')
-            return text_content[:5000], "text"  # Limit content for processing
-        except UnicodeDecodeError:
-            return f"Binary file: {file.filename} ({len(content)} bytes)", "binary"
-    except Exception as e:
-        return f"Error processing file: {str(e)}", "error"
+        async with aiofiles.open(file_path, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                total += len(chunk)
+                if total > MAX_FILE_SIZE:
+                    raise HTTPException(status_code=413, detail=f"File size exceeds {MAX_FILE_SIZE // (1024*1024)}MB limit")
+                await out.write(chunk)
+                if len(preview) < UPLOAD_PREVIEW_BYTES:
+                    preview.extend(chunk[:UPLOAD_PREVIEW_BYTES - len(preview)])
+    except BaseException:
+        file_path.unlink(missing_ok=True)
+        raise
+    
+    try:
+        # Incremental decoder so a multi-byte character cut at the preview
+        # boundary isn't mistaken for binary content
+        return codecs.getincrementaldecoder("utf-8")().decode(bytes(preview)), total
+    except UnicodeDecodeError:
+        return f"Binary file: {file.filename} ({total} bytes)", total
+
+async def load_uploaded_file(file_id: str) -> tuple[Optional[str], Optional[str]]:
+    """Return (content, original filename) of a previously uploaded file"""
+    # A short-lived session of its own, so no pooled connection sits idle in
+    # a transaction while the caller waits on the model
+    async with SessionLocal() as db:
+        upload = (await db.execute(
+            select(FileUpload.original_filename, FileUpload.upload_path).where(
+                FileUpload.file_id == file_id, FileUpload.is_deleted.is_(False)
+            )
+        )).first()
+    
+    if upload:
+        file_name, file_path = upload.original_filename, upload.upload_path
+    else:
+        # Files uploaded before uploads were recorded in the table
+        legacy_path = await asyncio.to_thread(lambda: next(UPLOAD_DIR.glob(f"{file_id}_*"), None))
+        if legacy_path is None:
+            return None, None
+        file_name, file_path = legacy_path.name.split("_", 1)[1], legacy_path
+    
+    try:
+        async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
+            return await f.read(), file_name
+    except UnicodeDecodeError:
+        return f"Binary file: {file_name}", file_name
+    except FileNotFoundError:
+        return None, None
+
+# Columns the history endpoints serialize; selecting them as plain rows skips
+# building and tracking a Conversation object per message
+CONVERSATION_LIST_COLUMNS = (
+    Conversation.id,
+    Conversation.user_message,
+    Conversation.agent_response,
+    Conversation.agent_used,
+    Conversation.created_at,
+)
+# The JSON extra_data column can be large, so list views leave it out
+CONVERSATION_COLUMNS = CONVERSATION_LIST_COLUMNS + (Conversation.extra_data,)
+
+async def save_chat_turn(db: AsyncSession, session_id: str, message_id: str, message: str,
+                         result: Dict[str, Any], file_content: Optional[str], file_name: Optional[str]) -> str:
+    """Persist one user message and the orchestrator result; returns the primary agent"""
+    # Determine which agent was used
+    agents_used = result.get("metadata", {}).get("agents_consulted", ["orchestrator"])
+    primary_agent = agents_used[0] if agents_used else "orchestrator"
+    
+    # Ensure session exists
+    session = await db.scalar(select(ChatSession).where(ChatSession.session_id == session_id))
+    if not session:
+        session = ChatSession(
+            session_id=session_id,
+            title=message[:50] + "..." if len(message) > 50 else message,
+            created_at=datetime.now(),
+            updated_at=datetime.now()
+        )
+        db.add(session)
+        await db.flush()
+    else:
+        session.updated_at = datetime.now()
+    
+    # Store conversation in database
+    conversation = Conversation(
+        session_id=session_id,
+        message_id=message_id,
+        user_message=message,
+        agent_response=result.get("final_response", "No response generated"),
+        agent_used=primary_agent,
+        extra_data={
+            **result.get("metadata", {}),
+            "file_attached": file_content is not None,
+            "file_name": file_name
+        }
+    )
+    db.add(conversation)
+    await db.flush()  # assigns conversation.id; the turn is committed once below
+    
+    # Store agent execution details in one multi-row INSERT
+    agent_responses = result.get("agent_responses", [])
+    if agents_used:
+        await db.execute(insert(AgentExecution), [
+            {
+                "conversation_id": conversation.id,
+                "agent_name": agent_name,
+                "input_data": {"message": message, "file_attached": file_content is not None},
+                "output_data": agent_responses[i] if i < len(agent_responses) else {},
+                "execution_time": 0,  # You can add timing later
+                "status": "success" if result.get("success") else "error"
+            }
+            for i, agent_name in enumerate(agents_used)
+        ])
+    
+    await db.commit()
+    await invalidate_session_cache(session_id)
+    
+    return primary_agent
     
 # Request/Response models
 class ChatRequest(BaseModel):
@@ -147,18 +406,18 @@ async def health():
 @app.get("/agents")
 async def list_agents():
     """Get list of available agents and their capabilities"""
-    status = orchestrator.get_agent_status()
+    status = cached_agent_status()
     return status
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat_with_agents(request: ChatRequest, db: Session = Depends(get_db)):
+async def chat_with_agents(request: ChatRequest, db: AsyncSession = Depends(get_db)):
     """Main chat endpoint - processes user messages through the agent system"""
     try:
         # Generate session ID if not provided
         session_id = request.session_id or str(uuid.uuid4())
         
         # Process the request through the orchestrator
-        result = orchestrator.process_request(request.message, session_id)
+        result = await orchestrator.process_request(request.message, session_id)
         
         # Determine which agent was used
         agents_used = result.get("metadata", {}).get("agents_consulted", ["orchestrator"])
@@ -173,21 +432,25 @@ async def chat_with_agents(request: ChatRequest, db: Session = Depends(get_db)):
             extra_data=result.get("metadata", {})
         )
         db.add(conversation)
-        db.commit()
+        await db.flush()  # assigns conversation.id; the turn is committed once below
         
-        # Store agent execution details
-        for i, agent_name in enumerate(agents_used):
-            execution = AgentExecution(
-                conversation_id=conversation.id,
-                agent_name=agent_name,
-                input_data={"message": request.message},
-                output_data=result.get("agent_responses", [{}])[i] if i < len(result.get("agent_responses", [])) else {},
-                execution_time=0,  # Could be measured in production
-                status="success" if result.get("success") else "error"
-            )
-            db.add(execution)
+        # Store agent execution details in one multi-row INSERT
+        agent_responses = result.get("agent_responses", [])
+        if agents_used:
+            await db.execute(insert(AgentExecution), [
+                {
+                    "conversation_id": conversation.id,
+                    "agent_name": agent_name,
+                    "input_data": {"message": request.message},
+                    "output_data": agent_responses[i] if i < len(agent_responses) else {},
+                    "execution_time": 0,  # Could be measured in production
+                    "status": "success" if result.get("success") else "error"
+                }
+                for i, agent_name in enumerate(agents_used)
+            ])
         
-        db.commit()
+        await db.commit()
+        await invalidate_session_cache(session_id)
         
         return ChatResponse(
             response=result.get("final_response", "I couldn't process your request."),
@@ -201,11 +464,12 @@ async def chat_with_agents(request: ChatRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
 @app.get("/conversations/{session_id}")
-async def get_conversation_history(session_id: str, db: Session = Depends(get_db)):
-    """Get conversation history for a session"""
-    conversations = db.query(Conversation).filter(
-        Conversation.session_id == session_id
-    ).order_by(Conversation.created_at).all()
+async def get_conversation_history(session_id: str, include_metadata: bool = False, db: AsyncSession = Depends(get_db)):
+    """Get conversation history for a session; per-message metadata only on request"""
+    columns = CONVERSATION_COLUMNS if include_metadata else CONVERSATION_LIST_COLUMNS
+    conversations = (await db.execute(
+        select(*columns).where(Conversation.session_id == session_id).order_by(Conversation.created_at)
+    )).all()
     
     return {
         "session_id": session_id,
@@ -216,40 +480,51 @@ async def get_conversation_history(session_id: str, db: Session = Depends(get_db
                 "agent_response": conv.agent_response,
                 "agent_used": conv.agent_used,
                 "created_at": conv.created_at,
-                "metadata": conv.extra_data
+                **({"metadata": conv.extra_data} if include_metadata else {})
             }
             for conv in conversations
         ]
     }
 
 @app.get("/analytics")
-async def get_analytics(db: Session = Depends(get_db)):
+async def get_analytics(db: AsyncSession = Depends(get_db)):
     """Get system analytics and usage statistics"""
     
-    # Get agent usage statistics
-    agent_usage = db.query(
-        AgentExecution.agent_name,
-        db.func.count(AgentExecution.id).label("usage_count")
-    ).group_by(AgentExecution.agent_name).all()
-    
-    # Get total conversations
-    total_conversations = db.query(Conversation).count()
+    cached = await cache_get(ANALYTICS_CACHE_KEY)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
+    # One pass over agent_executions: per-agent totals and successes via
+    # conditional aggregation, with the conversation count alongside
+    agent_usage = (await db.execute(
+        select(
+            AgentExecution.agent_name,
+            func.count(AgentExecution.id).label("usage_count"),
+            func.count(case((AgentExecution.status == "success", 1))).label("success_count"),
+            select(func.count()).select_from(Conversation).scalar_subquery().label("total_conversations")
+        ).group_by(AgentExecution.agent_name)
+    )).all()
+    
+    if agent_usage:
+        total_conversations = agent_usage[0].total_conversations
+    else:
+        total_conversations = await db.scalar(select(func.count()).select_from(Conversation))
     
     # Get success rate
-    successful_executions = db.query(AgentExecution).filter(
-        AgentExecution.status == "success"
-    ).count()
-    total_executions = db.query(AgentExecution).count()
+    successful_executions = sum(usage.success_count for usage in agent_usage)
+    total_executions = sum(usage.usage_count for usage in agent_usage)
     success_rate = (successful_executions / total_executions * 100) if total_executions > 0 else 100
     # success_rate = (successful_executions / total_executions * 100) if total_executions > 0 else 0
     
-    return {
+    analytics = {
         "total_conversations": total_conversations,
         "total_executions": total_executions,
         "success_rate": round(success_rate, 2),
         "agent_usage": {usage.agent_name: usage.usage_count for usage in agent_usage},
         "system_status": "operational"
     }
+    await cache_set(ANALYTICS_CACHE_KEY, orjson.dumps(analytics), ANALYTICS_CACHE_TTL)
+    return analytics
 
 @app.get("/system/status")
 async def get_system_status():
@@ -257,8 +532,8 @@ async def get_system_status():
     
     
     # Get system metrics
-    cpu_percent = psutil.cpu_percent(interval=1)
-    memory = psutil.virtual_memory()
+    cpu_percent = psutil.cpu_percent(interval=None)
+    memory = cached_memory_snapshot()
     
     return {
         "timestamp": time.time(),
@@ -267,7 +542,7 @@ async def get_system_status():
             "memory_usage": memory.percent,
             "available_memory_gb": round(memory.available / (1024**3), 2)
         },
-        "agents_status": orchestrator.get_agent_status(),
+        "agents_status": cached_agent_status(),
         "api_endpoints": {
             "health": " Active",
             "chat": " Active", 
@@ -335,7 +610,7 @@ async def quick_demo_test():
     demo_results = []
     
     # Test NLP Agent
-    nlp_result = orchestrator.process_request(
+    nlp_result = await orchestrator.process_request(
         "Analyze sentiment: 'This AI platform is incredible!'", 
         "demo-session"
     )
@@ -347,7 +622,7 @@ async def quick_demo_test():
     })
     
     # Test Code Agent  
-    code_result = orchestrator.process_request(
+    code_result = await orchestrator.process_request(
         "Write a Python function to add two numbers",
         "demo-session"
     )
@@ -359,7 +634,7 @@ async def quick_demo_test():
     })
     
     # Test Data Agent
-    data_result = orchestrator.process_request(
+    data_result = await orchestrator.process_request(
         "Help with data analysis workflow",
         "demo-session"
     )
@@ -385,7 +660,7 @@ async def quick_demo_test():
 
 # ----- NEW -----
 @app.post("/api/upload", response_model=FileUploadResponse)
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
     """Upload and process file for analysis"""
     
     # Validate file
@@ -398,26 +673,36 @@ async def upload_file(file: UploadFile = File(...)):
         file_id = str(uuid.uuid4())
         file_path = UPLOAD_DIR / f"{file_id}_{file.filename}"
         
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Process file content
-        file.file.seek(0)
-        content, content_type = await process_uploaded_file(file)
+        # Save file, reading the upload only once
+        content, file_size = await save_uploaded_file(file, file_path)
         
         # Get file info
         file_type = get_file_type(file.filename)
-        file_size = file_path.stat().st_size
+        preview = content[:500] + "..." if len(content) > 500 else content
+        
+        # Record the upload so chat requests can find it by file_id
+        db.add(FileUpload(
+            file_id=file_id,
+            original_filename=file.filename,
+            stored_filename=file_path.name,
+            file_size=file_size,
+            file_type=file_type,
+            mime_type=file.content_type or mimetypes.guess_type(file.filename)[0],
+            upload_path=str(file_path),
+            content_preview=preview
+        ))
+        await db.commit()
         
         return FileUploadResponse(
             file_id=file_id,
             filename=file.filename,
             size=file_size,
-            content_preview=content[:500] + "..." if len(content) > 500 else content,
+            content_preview=preview,
             file_type=file_type
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
 
@@ -425,32 +710,66 @@ async def upload_file(file: UploadFile = File(...)):
 async def get_chat_history(
     limit: int = 20,
     offset: int = 0,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get chat session history"""
     
-    # Get sessions with message counts
-    sessions_query = db.query(ChatSession).order_by(ChatSession.updated_at.desc())
-    total_sessions = sessions_query.count()
-    sessions = sessions_query.offset(offset).limit(limit).all()
+    # One round-trip. The page of sessions is picked first (with the overall
+    # total as a window over chat_sessions), then each of those sessions gets
+    # its message count and latest message from correlated subqueries that
+    # use the (session_id, created_at) index, so only the page's
+    # conversations are read. The preview is truncated in SQL as well
+    page = select(
+        ChatSession.id,
+        ChatSession.session_id,
+        ChatSession.title,
+        ChatSession.created_at,
+        ChatSession.updated_at,
+        func.count().over().label("total_sessions")
+    ).order_by(ChatSession.updated_at.desc(), ChatSession.id.desc()).offset(offset).limit(limit).subquery()
+    
+    message_count = (
+        select(func.count())
+        .where(Conversation.session_id == page.c.session_id)
+        .scalar_subquery()
+    )
+    last_message_preview = (
+        select(case(
+            (func.length(Conversation.user_message) > 100, func.substr(Conversation.user_message, 1, 100) + "..."),
+            else_=Conversation.user_message
+        ))
+        .where(Conversation.session_id == page.c.session_id)
+        .order_by(Conversation.created_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    rows = (await db.execute(
+        select(
+            page.c.session_id,
+            page.c.title,
+            page.c.created_at,
+            page.c.updated_at,
+            message_count.label("message_count"),
+            last_message_preview.label("last_message_preview"),
+            page.c.total_sessions
+        ).order_by(page.c.updated_at.desc(), page.c.id.desc())
+    )).all()
+    
+    if rows:
+        total_sessions = rows[0].total_sessions
+    else:
+        # An empty page (past the end, or limit=0) has no rows to carry the window count
+        total_sessions = await db.scalar(select(func.count()).select_from(ChatSession))
     
     session_data = []
-    for session in sessions:
-        message_count = db.query(Conversation).filter(
-            Conversation.session_id == session.session_id
-        ).count()
-        
-        last_message = db.query(Conversation).filter(
-            Conversation.session_id == session.session_id
-        ).order_by(Conversation.created_at.desc()).first()
-        
+    for row in rows:
         session_data.append({
-            "session_id": session.session_id,
-            "title": session.title,
-            "message_count": message_count,
-            "created_at": session.created_at,
-            "updated_at": session.updated_at,
-            "last_message_preview": last_message.user_message[:100] + "..." if last_message and len(last_message.user_message) > 100 else last_message.user_message if last_message else None
+            "session_id": row.session_id,
+            "title": row.title,
+            "message_count": row.message_count,
+            "created_at": row.created_at,
+            "updated_at": row.updated_at,
+            "last_message_preview": row.last_message_preview
         })
     
     return ChatHistoryResponse(
@@ -459,16 +778,23 @@ async def get_chat_history(
     )
 
 @app.get("/api/chat/session/{session_id}", response_model=SessionResponse)
-async def get_session_messages(session_id: str, db: Session = Depends(get_db)):
+async def get_session_messages(session_id: str, db: AsyncSession = Depends(get_db)):
     """Get all messages for a specific session"""
     
-    session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
+    cached = await cache_get(session_cache_key(session_id))
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    version = await get_session_version(session_id)
+    
+    session = (await db.execute(
+        select(ChatSession.created_at, ChatSession.updated_at).where(ChatSession.session_id == session_id)
+    )).first()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    conversations = db.query(Conversation).filter(
-        Conversation.session_id == session_id
-    ).order_by(Conversation.created_at).all()
+    conversations = (await db.execute(
+        select(*CONVERSATION_COLUMNS).where(Conversation.session_id == session_id).order_by(Conversation.created_at)
+    )).all()
     
     messages = []
     for conv in conversations:
@@ -490,41 +816,99 @@ async def get_session_messages(session_id: str, db: Session = Depends(get_db)):
             }
         ])
     
-    return SessionResponse(
+    response = SessionResponse(
         session_id=session_id,
         messages=messages,
         created_at=session.created_at,
         updated_at=session.updated_at,
         message_count=len(conversations)
     )
+    await cache_session_snapshot(session_id, version, response.model_dump_json())
+    return response
+
+@app.get("/api/chat/session/{session_id}/stream")
+async def stream_session_messages(session_id: str):
+    """Stream a session's messages as NDJSON: a session header line, then one line per message"""
+    
+    # Looked up before streaming so a missing session is still a 404; the
+    # session is closed again before the stream takes its own connection
+    async with SessionLocal() as db:
+        session = (await db.execute(
+            select(ChatSession.created_at, ChatSession.updated_at).where(ChatSession.session_id == session_id)
+        )).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    async def ndjson_stream():
+        yield orjson.dumps({
+            "type": "session",
+            "session_id": session_id,
+            "created_at": session.created_at,
+            "updated_at": session.updated_at
+        }) + b"\n"
+        
+        # Rows are fetched in batches from a server-side cursor, so memory
+        # stays flat however long the session is
+        message_count = 0
+        async with SessionLocal() as stream_db:
+            result = await stream_db.stream(
+                select(*CONVERSATION_COLUMNS)
+                .where(Conversation.session_id == session_id)
+                .order_by(Conversation.created_at)
+                .execution_options(yield_per=SESSION_STREAM_BATCH)
+            )
+            async for conv in result:
+                message_count += 1
+                yield orjson.dumps({
+                    "id": f"{conv.id}_user",
+                    "type": "user",
+                    "content": conv.user_message,
+                    "timestamp": conv.created_at,
+                    "metadata": conv.extra_data
+                }) + b"\n"
+                yield orjson.dumps({
+                    "id": f"{conv.id}_agent",
+                    "type": "agent",
+                    "content": conv.agent_response,
+                    "agent_used": conv.agent_used,
+                    "timestamp": conv.created_at,
+                    "metadata": conv.extra_data
+                }) + b"\n"
+        
+        yield orjson.dumps({"type": "end", "message_count": message_count}) + b"\n"
+    
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
 
 @app.delete("/api/chat/session/{session_id}")
-async def delete_session(session_id: str, db: Session = Depends(get_db)):
+async def delete_session(session_id: str, db: AsyncSession = Depends(get_db)):
     """Delete a chat session and all its messages"""
     
     # First, delete agent_executions that reference conversations in this session
-    conversations = db.query(Conversation).filter(Conversation.session_id == session_id).all()
-    conversation_ids = [conv.id for conv in conversations]
+    conversation_ids = (await db.scalars(
+        select(Conversation.id).where(Conversation.session_id == session_id)
+    )).all()
     
     if conversation_ids:
-        db.query(AgentExecution).filter(AgentExecution.conversation_id.in_(conversation_ids)).delete(synchronize_session=False)
+        await db.execute(
+            delete(AgentExecution).where(AgentExecution.conversation_id.in_(conversation_ids)).execution_options(synchronize_session=False)
+        )
     
     # Then delete conversations
-    db.query(Conversation).filter(Conversation.session_id == session_id).delete()
+    await db.execute(delete(Conversation).where(Conversation.session_id == session_id))
     
-    # Finally delete session
-    session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
-    if session:
-        db.delete(session)
+    # Finally delete session; a bulk delete, since the ORM cascade would have
+    # to lazy-load the (already deleted) conversations first
+    await db.execute(delete(ChatSession).where(ChatSession.session_id == session_id))
     
-    db.commit()
+    await db.commit()
+    await invalidate_session_cache(session_id)
     
     return {"message": "Session deleted successfully"}
 
 @app.get("/api/agents/status")
 async def get_real_time_agent_status():
-    """Get real-time agent processing status"""
-    return orchestrator.get_agent_status()
+    """Get agent processing status as seen by the worker that answers (up to STATUS_CACHE_TTL old)"""
+    return cached_agent_status()
 
 # MODIFY YOUR EXISTING /chat ENDPOINT
 # Find your existing @app.post("/chat", response_model=ChatResponse) function
@@ -535,7 +919,7 @@ async def chat_with_agents(
     message: str = Form(...),
     session_id: Optional[str] = Form(None),
     file_id: Optional[str] = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Enhanced chat endpoint with file support"""
     try:
@@ -547,75 +931,17 @@ async def chat_with_agents(
         message_id = str(uuid.uuid4())
         
         # Handle file content if provided
-        file_content = None
-        file_name = None
-        
-        if file_id:
-            # Find uploaded file
-            for file_path in UPLOAD_DIR.glob(f"{file_id}_*"):
-                file_name = file_path.name.split("_", 1)[1]
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        file_content = f.read()
-                except UnicodeDecodeError:
-                    file_content = f"Binary file: {file_name}"
-                break
+        file_content, file_name = await load_uploaded_file(file_id) if file_id else (None, None)
         
         # Process the request through the orchestrator
-        result = orchestrator.process_request(
+        result = await orchestrator.process_request(
             user_input=message,
             session_id=session_id,
             file_content=file_content,
             file_name=file_name
         )
         
-        # Determine which agent was used
-        agents_used = result.get("metadata", {}).get("agents_consulted", ["orchestrator"])
-        primary_agent = agents_used[0] if agents_used else "orchestrator"
-        
-        # Ensure session exists
-        session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
-        if not session:
-            session = ChatSession(
-                session_id=session_id,
-                title=message[:50] + "..." if len(message) > 50 else message,
-                created_at=datetime.now(),
-                updated_at=datetime.now()
-            )
-            db.add(session)
-            db.flush()
-        else:
-            session.updated_at = datetime.now()
-        
-        # Store conversation in database
-        conversation = Conversation(
-            session_id=session_id,
-            message_id=message_id,
-            user_message=message,
-            agent_response=result.get("final_response", "No response generated"),
-            agent_used=primary_agent,
-            extra_data={
-                **result.get("metadata", {}),
-                "file_attached": file_content is not None,
-                "file_name": file_name
-            }
-        )
-        db.add(conversation)
-        db.commit()
-        
-        # Store agent execution details
-        for i, agent_name in enumerate(agents_used):
-            execution = AgentExecution(
-                conversation_id=conversation.id,
-                agent_name=agent_name,
-                input_data={"message": message, "file_attached": file_content is not None},
-                output_data=result.get("agent_responses", [{}])[i] if i < len(result.get("agent_responses", [])) else {},
-                execution_time=0,  # You can add timing later
-                status="success" if result.get("success") else "error"
-            )
-            db.add(execution)
-        
-        db.commit()
+        primary_agent = await save_chat_turn(db, session_id, message_id, message, result, file_content, file_name)
         
         return ChatResponse(
             response=result.get("final_response", "I couldn't process your request."),
@@ -629,7 +955,41 @@ async def chat_with_agents(
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+
+@app.post("/api/chat/stream")
+async def chat_with_agents_stream(
+    message: str = Form(...),
+    session_id: Optional[str] = Form(None),
+    file_id: Optional[str] = Form(None)
+):
+    """Streaming chat endpoint - sends the reply as server-sent events while it is generated"""
+    session_id = session_id or str(uuid.uuid4())
+    message_id = str(uuid.uuid4())
+    file_content, file_name = await load_uploaded_file(file_id) if file_id else (None, None)
+    
+    async def event_stream():
+        async for event in orchestrator.process_request_stream(
+            user_input=message,
+            session_id=session_id,
+            file_content=file_content,
+            file_name=file_name
+        ):
+            if event["type"] == "done":
+                # Persist before announcing completion so a history reload sees it
+                async with SessionLocal() as db:
+                    event["agent_used"] = await save_chat_turn(db, session_id, message_id, message, event, file_content, file_name)
+                event.update(session_id=session_id, message_id=message_id, timestamp=datetime.now().isoformat())
+            yield f"data: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
     
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1"))
+    )
 
@@ -1,9 +1,51 @@
 import os
 import sys
+import time
 from sqlalchemy import create_engine, text
 from models.database import Base, engine
 
+# Arbitrary key for the Postgres advisory lock that serializes migrations
+MIGRATION_LOCK_ID = 4242001
+MIGRATION_LOCK_POLL_SECONDS = 1
+
+# Indexes for databases created before they were added to the models
+INDEXES = (
+    ("ix_conv_session_created", "conversations", "session_id, created_at"),
+    ("ix_exec_conv", "agent_executions", "conversation_id"),
+    ("ix_exec_agent_status", "agent_executions", "agent_name, status"),
+)
+
+# Indexes made redundant by one in INDEXES, dropped once it is built:
+# (name, index that covers it)
+OBSOLETE_INDEXES = (
+    ("ix_conversations_session_id", "ix_conv_session_created"),
+)
+
+COLUMN_UPGRADES = """
+    ALTER TABLE conversations ADD COLUMN IF NOT EXISTS message_id VARCHAR;
+    ALTER TABLE agent_executions ADD COLUMN IF NOT EXISTS error_details TEXT;
+    UPDATE conversations SET message_id = 'msg_' || id::text WHERE message_id IS NULL;
+"""
+
 def migrate_database():
+    """Run the migration once at a time across all containers starting up"""
+    if engine.dialect.name != "postgresql":
+        return _apply_migrations()
+    
+    # Waiters poll pg_try_advisory_lock instead of blocking in pg_advisory_lock:
+    # a blocked lock call holds a snapshot, and CREATE INDEX CONCURRENTLY in
+    # the lock holder would wait for that snapshot while the waiter waits for
+    # the lock, a cycle Postgres can't see. Between polls nothing is held
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        while not lock_conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID}).scalar():
+            print(" Waiting for another migration to finish...")
+            time.sleep(MIGRATION_LOCK_POLL_SECONDS)
+        try:
+            return _apply_migrations()
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+def _apply_migrations():
     """Migrate existing database to new schema"""
     
     print(" --- Starting database migration --- ")
@@ -13,40 +55,48 @@ def migrate_database():
         Base.metadata.create_all(bind=engine)
         print(" New tables created successfully")
         
-        # Add new columns to existing tables
-        with engine.connect() as conn:
-            # Add message_id to conversations table if it doesn't exist
-            try:
-                conn.execute(text("""
-                    ALTER TABLE conversations 
-                    ADD COLUMN IF NOT EXISTS message_id VARCHAR;
-                """))
-                print(" Added message_id column to conversations")
-            except Exception as e:
-                print(f"Note: message_id column might already exist: {e}")
-            
-            # Add error_details to agent_executions if it doesn't exist
-            try:
-                conn.execute(text("""
-                    ALTER TABLE agent_executions 
-                    ADD COLUMN IF NOT EXISTS error_details TEXT;
-                """))
-                print(" Added error_details column to agent_executions")
-            except Exception as e:
-                print(f"Note: error_details column might already exist: {e}")
+        # The rest upgrades tables created by older versions. It is Postgres
+        # SQL, and tables create_all has just made are already current
+        if engine.dialect.name != "postgresql":
+            print(" Database migration completed successfully!")
+            return True
+        
+        # Column upgrades go over in one round-trip and one transaction
+        with engine.begin() as conn:
+            conn.exec_driver_sql(COLUMN_UPGRADES)
+        print(" Added message_id and error_details columns; backfilled message IDs")
+        
+        # CONCURRENTLY keeps the tables writable but can't run in a transaction
+        # (or a multi-statement batch), so these go one at a time
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            # A failed or interrupted concurrent build leaves an INVALID index
+            # that IF NOT EXISTS would skip forever; drop it and build again.
+            # Builds only happen under the migration lock, so none is running
+            invalid = conn.execute(text("""
+                SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE NOT i.indisvalid AND c.relname = ANY(:names)
+            """), {"names": [name for name, _, _ in INDEXES]}).scalars().all()
+            for name in invalid:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                print(f" Dropped invalid index {name}")
             
-            # Update existing conversations with message_ids
-            try:
-                conn.execute(text("""
-                    UPDATE conversations 
-                    SET message_id = 'msg_' || id::text 
-                    WHERE message_id IS NULL;
-                """))
-                print(" Updated existing conversations with message IDs")
-            except Exception as e:
-                print(f"Note: Error updating message IDs: {e}")
+            built = set()
+            for name, table, columns in INDEXES:
+                try:
+                    conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})"))
+                    built.add(name)
+                    print(f" Created index {name}")
+                except Exception as e:
+                    print(f"Note: Error creating index {name}: {e}")
             
-            conn.commit()
+            for name, covered_by in OBSOLETE_INDEXES:
+                if covered_by not in built:
+                    continue
+                try:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                    print(f" Dropped redundant index {name}")
+                except Exception as e:
+                    print(f"Note: Error dropping index {name}: {e}")
         
         print(" Database migration completed successfully!")
         
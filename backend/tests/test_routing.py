@@ -0,0 +1,26 @@
+import pytest
+
+from agents.enhanced_orchestrator import EnhancedGeminiOrchestrator
+
+
+@pytest.fixture(scope="module")
+def orchestrator():
+    return EnhancedGeminiOrchestrator()
+
+
+@pytest.mark.parametrize("user_input, expected", [
+    ("create a graph of monthly sales", "data"),
+    ("create a plot", "nlp"),
+    ("develop a dashboard showing numbers", "nlp"),
+    ("plot these numbers", "nlp"),
+    ("write a python function to sort a list", "code"),
+    ("summarize this document", "nlp"),
+    ("show statistics for this dataset", "data"),
+])
+def test_route_request(orchestrator, user_input, expected):
+    assert orchestrator._route_request(user_input) == expected
+
+
+def test_select_agents_only_considers_matching_agents(orchestrator):
+    assert orchestrator._select_agents("create a graph of monthly sales") == ["data"]
+    assert orchestrator._select_agents("create a plot") == ["nlp"]